@@ -0,0 +1,82 @@
+"""
+Benchmark the per-query cost of halfspace label imputation.
+
+Replays an active max session and times each imputation, both by solving
+fresh linear programs over all the labelled hyperplanes (impute_label) and
+with the incremental ShatterEngine used by the eliciters.
+
+Run with `python benchmarks/bench_halfspace.py [n] [d]`.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+
+import sys
+import time
+import numpy as np
+from deva import halfspace
+
+
+def session(n, d, seed=42):
+    """Record the hyperplanes and oracle labels of an active max session."""
+    random = np.random.RandomState(seed)
+    X = random.randn(n, d)
+    r = random.randn(d) * 3
+
+    def oracle(a, b):
+        return -1 if ((a - r)**2).sum() < ((b - r)**2).sum() else 1
+
+    maxer = halfspace.HalfspaceMax(
+        X, query_order=halfspace.max_compar_rand, yield_indices=True
+    )
+    while maxer.next_round():
+        a, b = maxer.get_query()
+        maxer.put_response(oracle(X[a], X[b]))
+
+    # reconstruct the comparison sequence
+    X = X[maxer.order]
+    planes = []
+    maxi = 0
+    for i in range(1, n):
+        planes.append(halfspace.hyperplane(X[maxi], X[i]))
+        if maxer.Y[i - 1] == -1:
+            maxi = i
+    return np.array(planes), maxer.Y
+
+
+def fresh(H, Y):
+    """Impute each label by solving from scratch."""
+    times = []
+    Y_hat = np.zeros_like(Y)
+    for i in range(len(Y)):
+        start = time.perf_counter()
+        halfspace.impute_label(H[:i + 1], Y_hat[:i + 1])
+        times.append(time.perf_counter() - start)
+        Y_hat[i] = Y[i]
+    return times
+
+
+def incremental(H, Y):
+    """Impute each label with a persistent engine."""
+    times = []
+    engine = halfspace.ShatterEngine(H.shape[1] - 1)
+    for h, y in zip(H, Y):
+        start = time.perf_counter()
+        label = engine.impute(h)
+        times.append(time.perf_counter() - start)
+        if not label:
+            engine.add(h, y)
+    return times
+
+
+def main(n=300, d=4):
+    """Print the per-query latency of both approaches."""
+    H, Y = session(n, d)
+    print(f"{len(Y)} comparisons of {d}-dimensional candidates")
+    for name, method in [("fresh", fresh), ("incremental", incremental)]:
+        t = np.array(method(H, Y)) * 1e3
+        print(f"{name:>12s}: mean {t.mean():.2f}ms, "
+              f"p95 {np.percentile(t, 95):.2f}ms, total {t.sum():.0f}ms")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
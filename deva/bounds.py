@@ -9,6 +9,10 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.neighbors import KNeighborsClassifier
 
 
+N_SAMPLES = 1000  # random queries to choose the least confident from
+MAX_RESAMPLE = 100  # rounds of redrawing invalid random queries
+
+
 # Things to try:
 # TODO: limit query perturbations to 2 dimensions
 # TODO: provide a tunable exploration/exploitation balance
@@ -36,8 +40,42 @@ class BoundsEliciter:
 
     def check_valid(self, q):
         """Determine whether a query is valid."""
-        # could be something like (choice < 0).any():
-        return True  # placeholder
+        return bool(self.valid_mask(np.asarray(q)[np.newaxis])[0])
+
+    def valid_mask(self, Q):
+        """Determine which rows of an array of queries are valid."""
+        # could be something like ~(Q < 0).any(axis=1)
+        return np.ones(len(Q), dtype=bool)  # placeholder
+
+    def sample(self, draw, n):
+        """
+        Draw random valid queries, redrawing only the invalid ones.
+
+        Parameters
+        ----------
+            draw: callable
+                draws a given number of random queries as an array
+            n: int
+                the number of queries to draw
+
+        Returns
+        -------
+            array:
+                the valid queries (up to n of them)
+        """
+        Q = draw(n)
+        invalid = np.flatnonzero(~self.valid_mask(Q))
+        for _ in range(MAX_RESAMPLE):
+            if not len(invalid):
+                return Q
+            Q[invalid] = draw(len(invalid))
+            invalid = invalid[~self.valid_mask(Q[invalid])]
+
+        valid = np.ones(n, dtype=bool)
+        valid[invalid] = False
+        if not valid.any():
+            raise RuntimeError("Could not sample a valid query.")
+        return Q[valid]
 
     def predict(self, query):
         """Provide a "best guess" prediction."""
@@ -48,6 +86,43 @@ class BoundsEliciter:
         raise NotImplementedError
 
 
+class TrainingData:
+    """
+    Labelled queries held in preallocated arrays.
+
+    The arrays double in size when they are full, so appending a query costs
+    amortised constant time, and X and y are views of the filled rows.
+    """
+
+    def __init__(self, X, y, capacity=64):
+        X = np.asarray(X, dtype=float)
+        n, d = X.shape
+        self.n = n
+        self._X = np.empty((max(n, capacity), d))
+        self._y = np.empty(max(n, capacity), dtype=int)
+        self._X[:n] = X
+        self._y[:n] = y
+
+    @property
+    def X(self):
+        """Get the queries."""
+        return self._X[:self.n]
+
+    @property
+    def y(self):
+        """Get the labels."""
+        return self._y[:self.n]
+
+    def append(self, x, label):
+        """Add a labelled query."""
+        if self.n == len(self._y):
+            self._X = np.vstack((self._X, np.empty_like(self._X)))
+            self._y = np.concatenate((self._y, np.empty_like(self._y)))
+        self._X[self.n] = x
+        self._y[self.n] = label
+        self.n += 1
+
+
 class KNeighborsEliciter(BoundsEliciter):
     """
     Bounds elicitation using a non-linear classifier.
@@ -56,7 +131,8 @@ class KNeighborsEliciter(BoundsEliciter):
     Note this does not take into account sampling density.
     """
 
-    def __init__(self, ref, table, attribs, steps):
+    def __init__(self, ref, table, attribs, steps, n_samples=N_SAMPLES,
+                 random_state=None):
         """
         Bounds elicitation using a non-linear classifier.
 
@@ -71,8 +147,14 @@ class KNeighborsEliciter(BoundsEliciter):
                 metrics for each candidate
             steps: int
                 decides when to terminate
+            n_samples: int
+                the number of random queries to choose each query from
+            random_state: int or Generator
+                seeds the random queries
         """
         self.attribs = attribs
+        self.n_samples = n_samples
+        self.rng = np.random.default_rng(random_state)
         radius = 0.5 * table.std(axis=0)  # scale of perturbations
         ref = np.asarray(ref, dtype=float)  # sometimes autocasts to long int
         radius = np.asarray(radius, dtype=float)
@@ -83,43 +165,35 @@ class KNeighborsEliciter(BoundsEliciter):
         self.steps = steps
         self._converge = 0  # No. of steps when the model starts to be stable
 
-        self.neigh = KNeighborsClassifier(n_neighbors=5)
+        # brute force search just keeps the data, so refits are cheap
+        self.neigh = KNeighborsClassifier(n_neighbors=5, algorithm="brute")
 
         # Initialise
         X = [[10, 0], [20, 0], [150, 0], [0, 10],
              [0, 20], [0, 150], [100, 100]]
         y = [1, 1, 0, 1, 1, 0, 0]
-        self.X = X
-        self.y = y
+        self.data = TrainingData(X, y)
 
-        self.neigh.fit(self.X, self.y)
+        self.neigh.fit(self.data.X, self.data.y)
 
         self._update()
 
     # input
     def put(self, label):
         """Accept a user input."""
-        self.X.append(self.choice)
-        self.y.append(label)
+        self.data.append(self.choice, label)
 
-        self.neigh.fit(self.X, self.y)
+        self.neigh.fit(self.data.X, self.data.y)
 
         self._update()
 
     def _update(self):
         # make random candidates
         def random_choice(n):
-            choices = []
-            for _ in range(n):
-                while True:
-                    choice = np.random.rand(len(self.ref)) * 100
-                    choices.append(choice)
-                    if self.check_valid(choice):
-                        break
-            return choices
+            return self.rng.random((n, len(self.ref))) * 100
 
         # KNeighborsRegressor
-        test_X = random_choice(1000)
+        test_X = self.sample(random_choice, self.n_samples)
 
         # finding the least confident candidate
         probabilities = self.neigh.predict_proba(test_X)[:, 1]
@@ -160,7 +234,8 @@ class LinearActive(BoundsEliciter):
     """
 
     def __init__(self, ref, table, attribs,
-                 steps, epsilon, n_steps_converge):
+                 steps, epsilon, n_steps_converge, n_samples=N_SAMPLES,
+                 random_state=None, query_mode="sample"):
         """
         Bounds eliciter using a Logistic Regressor model.
 
@@ -180,8 +255,22 @@ class LinearActive(BoundsEliciter):
                 from the previous step to determine when to terminate
             n_steps_converge: int
                 the number of steps that shows the model converges
+            n_samples: int
+                the number of random queries to choose each query from
+            random_state: int or Generator
+                seeds the random queries
+            query_mode: str
+                "sample" chooses the least confident of n_samples random
+                queries, and "plane" chooses from a few queries placed on
+                the decision plane, taking the one farthest from the
+                labelled queries
         """
+        if query_mode not in ("sample", "plane"):
+            raise ValueError(f"Unknown query mode {query_mode}.")
         self.attribs = attribs
+        self.n_samples = n_samples
+        self.rng = np.random.default_rng(random_state)
+        self.query_mode = query_mode
         radius = 0.5 * table.std(axis=0)  # scale of perturbations
         ref = np.asarray(ref, dtype=float)  # sometimes autocasts to long int
         radius = np.asarray(radius, dtype=float)
@@ -196,25 +285,24 @@ class LinearActive(BoundsEliciter):
 
         self.old_w = 0
 
-        self.lr = LogisticRegression()  # Create a logistic regression instance
+        # each fit starts from the previous solution
+        self.lr = LogisticRegression(warm_start=True)
 
         # Initialise
         X = [ref + radius, ref - radius]
         y = [0, 1]
-        self.X = X
-        self.y = y
+        self.data = TrainingData(X, y)
 
-        self.lr.fit(self.X, self.y)
+        self.lr.fit(self.data.X, self.data.y)
 
         self._update()
         self.baseline = elicit.Candidate("baseline", dict(zip(attribs, ref)))
 
     def put(self, label):
         """Input a user decision."""
-        self.X.append(self.choice)
-        self.y.append(label)
+        self.data.append(self.choice, label)
 
-        self.lr.fit(self.X, self.y)
+        self.lr.fit(self.data.X, self.data.y)
 
         self._update()
 
@@ -226,26 +314,10 @@ class LinearActive(BoundsEliciter):
 
         self.old_w = self.w.copy()
 
-        # Helper function: make random candidate
-        def random_choice(n):
-            choices = []
-            for _ in range(n):
-                while True:
-                    diff = np.random.randn(len(self.ref)) * self.radius
-                    choice = self.ref + diff
-                    choices.append(choice)
-                    if self.check_valid(choice):
-                        break
-            return choices
-
-        # logistic regressor
-        test_X = random_choice(1000)
-
-        # finding the least confident candidate
-        probabilities = self.lr.predict_proba(test_X)[:, 1]
-        min_index = np.argmin(np.abs(probabilities - 0.5))
-
-        self.choice = test_X[min_index]
+        if self.query_mode == "plane":
+            self.choice = self._plane_choice()
+        else:
+            self.choice = self._sample_choice()
 
         self.query = elicit.Candidate(
             elicit.autoname(self._step),
@@ -261,6 +333,39 @@ class LinearActive(BoundsEliciter):
 
         return
 
+    def _sample_choice(self):
+        # Helper function: make random candidates
+        def random_choice(n):
+            diff = self.rng.standard_normal((n, len(self.ref))) * self.radius
+            return self.ref + diff
+
+        # logistic regressor
+        test_X = self.sample(random_choice, self.n_samples)
+
+        # finding the least confident candidate
+        probabilities = self.lr.predict_proba(test_X)[:, 1]
+        min_index = np.argmin(np.abs(probabilities - 0.5))
+
+        return test_X[min_index]
+
+    def _plane_choice(self):
+        # the point of the decision plane w @ x + b = 0 nearest the reference
+        w = self.w
+        b = self.lr.intercept_[0]
+        centre = self.ref - w * (w @ self.ref + b) / (w @ w)
+
+        # perturb within the plane, as in PlaneSampler
+        def plane_choice(n):
+            diff = self.rng.standard_normal((n, len(w))) * self.radius
+            diff -= np.outer(diff @ w, w) / (w @ w)  # make perpendicular
+            return centre + diff
+
+        test_X = self.sample(plane_choice, 2 * len(w))
+
+        # explore, choosing the query farthest from the labelled ones
+        gap = ((test_X[:, np.newaxis] - self.data.X)**2).sum(axis=2)
+        return test_X[np.argmax(gap.min(axis=1))]
+
     def predict(self, q):
         """Make a prediction using the learned weights."""
         return ((q - self.ref) @ self.w < 0)
@@ -314,14 +419,14 @@ class LinearRandom(BoundsEliciter):
         self._step = 0
         self.steps = steps
 
-        self.lr = LogisticRegression()  # Create a logistic regression instance
+        # each fit starts from the previous solution
+        self.lr = LogisticRegression(warm_start=True)
 
         # Initialise
         X = [ref + radius, ref - radius]
         y = [0, 1]
-        self.X = X
-        self.y = y
-        self.lr.fit(self.X, self.y)
+        self.data = TrainingData(X, y)
+        self.lr.fit(self.data.X, self.data.y)
 
         self._update()
 
@@ -329,10 +434,9 @@ class LinearRandom(BoundsEliciter):
 
     def put(self, label):
         """Enter a user choice."""
-        self.X.append(self.choice)
-        self.y.append(label)
+        self.data.append(self.choice, label)
 
-        self.lr.fit(self.X, self.y)
+        self.lr.fit(self.data.X, self.data.y)
 
         self._update()
 
@@ -447,12 +551,8 @@ class PlaneSampler(BoundsEliciter):
 
 def tabulate(candidates, metrics):
     """Convert candidates to a table of attributes."""
-    attribs = sorted(candidates[0].attributes)
-    table = np.zeros((len(candidates), len(attribs)))
-    for i, c in enumerate(candidates):
-        table[i, :] = [c[a] for a in attribs]
-
-    return attribs, table
+    candidates = elicit.CandidateSet.from_candidates(candidates)
+    return candidates.attribs, candidates.scores
 
 
 def distance(a, center):
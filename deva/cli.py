@@ -0,0 +1,43 @@
+"""
+Command line tools for deployments.
+
+These build the compiled model caches of scenarios and purge abandoned
+elicitation sessions from redis.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+
+import click
+from deva import db, fileio
+
+
+@click.group()
+def cli():
+    """DEVA scenario and session tools."""
+
+
+@cli.command("build-cache")
+@click.argument("scenarios", nargs=-1)
+def build_cache(scenarios):
+    """Rebuild the compiled model cache of SCENARIOS (default all)."""
+    if not scenarios:
+        scenarios = sorted(fileio.list_scenarios())
+
+    for name in scenarios:
+        n = fileio.build_cache(name)
+        click.echo(f"{name}: cached {n} models.")
+
+
+@cli.command("purge-sessions")
+@click.option("--host", default="127.0.0.1", help="Redis server.")
+@click.option("--port", default=6379, help="Redis port.")
+@click.option("--max-age", default=db.SESSION_TTL,
+              help="Seconds since a session's last use to keep it.")
+def purge_sessions(host, port, max_age):
+    """Delete abandoned elicitation sessions from redis."""
+    n = db.purge(db.connect(host, port), max_age)
+    click.echo(f"Deleted {n} sessions.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,95 @@
+"""
+Clustering engines for choosing representative candidates.
+
+Each engine takes a score matrix X of shape (n, d), the number of clusters k
+and optionally the centres found at the previous step, and returns k centres.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+
+SEED = 42  # fixed so that the same answers give the same questions
+N_INIT = 4  # k-means restarts when not warm-started
+BATCH_SIZE = 1024  # rows per mini-batch k-means step
+
+
+def kmeans(X, k, init=None):
+    """Cluster with seeded k-means."""
+    model = KMeans(n_clusters=k, n_init=N_INIT, random_state=SEED)
+    return model.fit(X).cluster_centers_
+
+
+def minibatch(X, k, init=None):
+    """Cluster with seeded mini-batch k-means."""
+    model = MiniBatchKMeans(n_clusters=k, n_init=N_INIT, random_state=SEED,
+                            batch_size=BATCH_SIZE)
+    return model.fit(X).cluster_centers_
+
+
+def warm(X, k, init=None):
+    """Cluster with k-means, starting from the previous step's centres."""
+    if init is None or len(init) != k:
+        return kmeans(X, k)
+    model = KMeans(n_clusters=k, init=init, n_init=1, random_state=SEED)
+    return model.fit(X).cluster_centers_
+
+
+def farthest(X, k, init=None):
+    """Cluster by taking the k rows of X chosen by `spread`."""
+    return X[spread(X, k)]
+
+
+engines = {
+    "kmeans": kmeans,
+    "minibatch": minibatch,
+    "warm": warm,
+    "farthest": farthest,
+}
+
+
+def nearest(X, centres):
+    """Find the index of the row of X nearest to each centre."""
+    # squared distances, dropping the |centre|^2 term that is constant per
+    # centre and so does not affect the nearest row
+    dist = (X**2).sum(axis=1)[:, np.newaxis] - 2 * X @ centres.T
+    return np.argmin(dist, axis=0)
+
+
+def spread(X, k):
+    """
+    Select the indices of k rows of X by deterministic farthest point sampling.
+
+    The columns are scaled by their range, and the first row is the one
+    nearest the mean. Each subsequent row is the one farthest from the rows
+    selected so far.
+    """
+    Z = _scaled(X)
+    chosen = [np.argmin(((Z - Z.mean(axis=0))**2).sum(axis=1))]
+    dist = ((Z - Z[chosen[0]])**2).sum(axis=1)
+    for _ in range(1, k):
+        chosen.append(np.argmax(dist))
+        dist = np.minimum(dist, ((Z - Z[chosen[-1]])**2).sum(axis=1))
+    return np.array(chosen)
+
+
+def grid(X, bins):
+    """
+    Select one row of X from each occupied cell of a regular grid.
+
+    The grid has `bins` cells along each column's range, and the first row in
+    each cell is kept. Returns the selected indices in increasing order.
+    """
+    Z = _scaled(X - X.min(axis=0))
+    cells = np.minimum((Z * bins).astype(int), bins - 1)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    return np.sort(first)
+
+
+def _scaled(X):
+    """Divide the columns of X by their range (where it is non-zero)."""
+    scale = np.ptp(X, axis=0)
+    scale[scale == 0] = 1.
+    return X / scale
@@ -5,14 +5,233 @@ Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
 
-import sys
+import io
+import copy
+import time
+import types
 import pickle
+import fnmatch
 import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import redis
+
+
+FORMAT = b"DEVA\x01"  # magic and version of the session format
+BLOB_MIN = 4096  # bytes above which read-only arrays are stored by digest
+BLOB_TTL = 24 * 60 * 60  # seconds to keep blobs after they are last written
+BLOB_CACHE = 64  # decoded blobs kept in memory
+SESSION_TTL = 24 * 60 * 60  # seconds to keep a session after its last use
+SESSIONS = "sessions"  # sorted set of session ids by their last use
+RETRIES = 3  # attempts after the first for a failed redis command
+BACKOFF = 0.05  # seconds before the first retry, doubling each time
+TRANSIENT = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+
+class StorageError(RuntimeError):
+    """The session storage could not be reached."""
+
+
+class SessionExpired(LookupError):
+    """The session refers to stored data that has expired."""
+
+
+def connect(host, port, db=0, max_connections=16, timeout=2.):
+    """
+    Make a redis client with a blocking connection pool.
+
+    Parameters
+    ----------
+    host: str
+        the redis server
+    port: int
+        the redis port
+    db: int
+        the redis database number
+    max_connections: int
+        the size of the pool, after which callers wait for a connection
+    timeout: float
+        seconds to wait for a connection (from the pool or the server)
+
+    Returns
+    -------
+    redis.Redis:
+        the client
+    """
+    pool = redis.BlockingConnectionPool(
+        host=host, port=port, db=db,
+        max_connections=max_connections,
+        timeout=timeout,
+        socket_connect_timeout=timeout,
+        socket_timeout=timeout,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def encode(value, put_blob, blobs=None):
+    """
+    Serialise session state compactly.
+
+    Large read-only arrays (the immutable scenario data) are stored once, by
+    the sha1 digest of their content, and referenced from the pickle of the
+    mutable state.
+
+    Parameters
+    ----------
+    value: object
+        the state to serialise
+    put_blob: callable
+        stores the bytes of an array under its (hex) digest
+    blobs: dict, optional
+        collects the arrays the state refers to, by digest
+
+    Returns
+    -------
+    bytes:
+        the versioned session data
+    """
+    buf = io.BytesIO()
+    buf.write(FORMAT)
+    _Pickler(buf, put_blob, blobs).dump(value)
+    return buf.getvalue()
+
+
+def decode(raw, get_blob, blobs=None):
+    """
+    Deserialise session state written by `encode`.
+
+    Parameters
+    ----------
+    raw: bytes
+        the session data, which may also be a plain (legacy) pickle
+    get_blob: callable
+        fetches the bytes of an array given its (hex) digest
+    blobs: dict, optional
+        collects the arrays the state refers to, by digest
+
+    Returns
+    -------
+    object:
+        the session state
+
+    Raises
+    ------
+    SessionExpired:
+        if an array the state refers to is no longer stored
+    """
+    if not raw.startswith(FORMAT):
+        return pickle.loads(raw)
+    buf = io.BytesIO(raw)
+    buf.seek(len(FORMAT))
+    return _Unpickler(buf, get_blob, blobs).load()
+
+
+_digests = {}  # id(array) -> (weak reference, digest)
+_blobs = OrderedDict()  # digest -> read-only array
+_written = {}  # digest -> time it was last put
+_lock = threading.RLock()  # for the above, shared by request threads
+
+
+class _Pickler(pickle.Pickler):
+
+    def __init__(self, file, put_blob, blobs):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.put_blob = put_blob
+        self.blobs = blobs
+
+    def persistent_id(self, obj):
+        if (type(obj) is not np.ndarray or obj.flags.writeable
+                or obj.nbytes < BLOB_MIN or obj.dtype.hasobject):
+            return None
+
+        digest = _digest(obj)
+        with _lock:
+            written = _written.get(digest, -BLOB_TTL)
+        if time.time() - written > BLOB_TTL / 2:
+            _put(self.put_blob, digest, obj)
+        _cache(digest, obj)
+        if self.blobs is not None:
+            self.blobs[digest] = obj
+        return ("blob", digest)
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file, get_blob, blobs):
+        super().__init__(file)
+        self.get_blob = get_blob
+        self.blobs = blobs
+
+    def persistent_load(self, pid):
+        kind, digest = pid
+        if kind != "blob":
+            raise pickle.UnpicklingError(f"Unknown reference {kind}.")
+        with _lock:
+            array = _blobs.get(digest)
+            if array is not None:
+                _blobs.move_to_end(digest)
+        if array is None:
+            array = self._fetch(digest)
+        if self.blobs is not None:
+            self.blobs[digest] = array
+        return array
+
+    def _fetch(self, digest):
+        data = self.get_blob(digest)
+        if data is None:
+            raise SessionExpired(f"Missing blob {digest}.")
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+        array.setflags(write=False)
+        _remember(array, digest)
+        _cache(digest, array)
+        return array
+
+
+def _put(put_blob, digest, array):
+    """Store an array's bytes under its digest."""
+    data = io.BytesIO()
+    np.save(data, array, allow_pickle=False)
+    put_blob(digest, data.getvalue())
+    with _lock:
+        _written[digest] = time.time()
+
+
+def _digest(array):
+    """Hash an array's content, remembering the digest for the array."""
+    with _lock:
+        known = _digests.get(id(array))
+    if known is not None and known[0]() is array:
+        return known[1]
+
+    h = hashlib.sha1(str((array.dtype.str, array.shape)).encode())
+    h.update(np.ascontiguousarray(array).data)
+    digest = h.hexdigest()
+    _remember(array, digest)
+    return digest
+
+
+def _remember(array, digest):
+    key = id(array)
+    ref = weakref.ref(array, lambda _: _digests.pop(key, None))
+    with _lock:
+        _digests[key] = (ref, digest)
+
+
+def _cache(digest, array):
+    with _lock:
+        _blobs[digest] = array
+        _blobs.move_to_end(digest)
+        while len(_blobs) > BLOB_CACHE:
+            _blobs.popitem(last=False)
 
 
 class DB:
     """Base class with the accessors for the various bits of state."""
 
+    KEYS = ("eliciter", "bounder", "logger", "branches")
+
     def __init__(self):
         raise NotImplementedError()
 
@@ -25,6 +244,19 @@ class DB:
     def _del(self, key):
         raise NotImplementedError()
 
+    def prefetch(self, *keys):
+        """Load the given keys ahead of their use (where supported)."""
+
+    def flush(self):
+        """Write back the changes made in this request (where deferred)."""
+
+    def discard(self):
+        """Forget the changes made in this request (where deferred)."""
+
+    def bind(self, ident):
+        """Get storage for the session ident outside of its requests."""
+        raise NotImplementedError()
+
     @property
     def eliciter(self):
         """Access the session eliciter instance (if applicable)."""
@@ -64,35 +296,349 @@ class DB:
     def logger(self):
         return self._del("logger")
 
+    @property
+    def branches(self):
+        """Access the session's precomputed answers (if any)."""
+        return self._get("branches")
+
+    @branches.setter
+    def branches(self, value):
+        return self._set("branches", value)
+
+    @branches.deleter
+    def branches(self):
+        return self._del("branches")
+
 
 class RedisDB(DB):
-    """Key-value storage with redis."""
+    """
+    Key-value storage with redis.
 
-    def __init__(self, redis_client, session):
+    Values are memoised on `scope`, an object local to each request (such as
+    flask.g), so each key is read and decoded at most once per request.
+    Changes are kept there too until `flush` writes them all back in one
+    pipelined transaction, which also refreshes the expiry of every key the
+    request used (and of the scenario data they refer to) and records the
+    session's last use for `purge` (dropping the records of the sessions that
+    have expired since). Scenario data that redis no longer has
+    (e.g. after a restart) is then put back.
+
+    Commands that fail to reach redis are retried with exponential backoff,
+    and StorageError is raised if they still fail.
+    """
+
+    def __init__(self, redis_client, session, scope, ttl=SESSION_TTL,
+                 retries=RETRIES, backoff=BACKOFF):
         self.r = redis_client
         self.session = session
-        try:
-            self.r.ping()
-        except Exception:
-            print("Could not connect to Redis database")
-            sys.exit(-1)
+        self.scope = scope
+        self.ttl = ttl
+        self.blob_ttl = max(BLOB_TTL, ttl)  # outlive the sessions using them
+        self.retries = retries
+        self.backoff = backoff
+        self._retry(self.r.ping)
+
+    def _retry(self, command, *args, **kwargs):
+        """Run a redis command, retrying if redis cannot be reached."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                return command(*args, **kwargs)
+            except TRANSIENT as e:
+                if attempt == self.retries:
+                    raise StorageError("Could not reach Redis database") from e
+            time.sleep(delay)
+            delay *= 2
+
+    def _key(self, key):
+        return self.session["id"] + "/" + key
+
+    def _memo(self):
+        """Get the request's memoised values, changed keys and blobs used."""
+        if not hasattr(self.scope, "deva_memo"):
+            self.scope.deva_memo = ({}, set(), {})
+        return self.scope.deva_memo
 
     def _get(self, key):
-        ident = self.session["id"]
-        raw = self.r.get(ident + "/" + key)
-        result = pickle.loads(raw)
-        print(f"getting {key}:", hashlib.md5(raw).hexdigest())
-        return result
+        values = self._memo()[0]
+        key = self._key(key)
+        if key not in values:
+            values[key] = self._decode(self._retry(self.r.get, key))
+        return values[key]
 
     def _set(self, key, value):
-        ident = self.session["id"]
-        raw = pickle.dumps(value)
-        self.r.set(ident + "/" + key, raw)
-        print(f"setting {key}: ", hashlib.md5(raw).hexdigest())
+        values, dirty, _ = self._memo()
+        key = self._key(key)
+        values[key] = value
+        dirty.add(key)
 
     def _del(self, key):
-        ident = self.session["id"]
-        self.r.delete(ident + "/" + key)
+        self._set(key, None)
+
+    def prefetch(self, *keys):
+        """Load the given keys in one round trip."""
+        values = self._memo()[0]
+        keys = [k for k in map(self._key, keys) if k not in values]
+        if keys:
+            for key, raw in zip(keys, self._retry(self.r.mget, keys)):
+                values[key] = self._decode(raw)
+
+    def flush(self):
+        """Write back the request's changes in one pipelined transaction."""
+        values, dirty, blobs = self._memo()
+        if not values:
+            return
+        writes = {k: encode(values[k], self._put_blob, blobs) for k in dirty
+                  if values[k] is not None}
+
+        def send():
+            pipe = self.r.pipeline(transaction=True)
+            for digest in blobs:
+                pipe.expire("blob/" + digest, self.blob_ttl)
+            for key, value in values.items():
+                if key in writes:
+                    pipe.set(key, writes[key], ex=self.ttl)
+                elif key in dirty:
+                    pipe.delete(key)
+                elif value is not None:
+                    pipe.expire(key, self.ttl)
+            # and forget the sessions that have expired by themselves
+            now = time.time()
+            pipe.zadd(SESSIONS, {self.session["id"]: now})
+            pipe.zremrangebyscore(SESSIONS, "-inf", now - self.ttl)
+            return pipe.execute()
+
+        results = self._retry(send)
+
+        # put the blobs back that redis has lost (e.g. by restarting), which
+        # this process may think it wrote recently
+        for digest, found in zip(blobs, results):
+            if not found:
+                _put(self._put_blob, digest, blobs[digest])
+        self.discard()
+
+    def discard(self):
+        """Forget the values memoised in this request."""
+        if hasattr(self.scope, "deva_memo"):
+            del self.scope.deva_memo
+
+    def bind(self, ident):
+        """Get storage for the session ident, with its own scope."""
+        bound = copy.copy(self)
+        bound.session = {"id": ident}
+        bound.scope = types.SimpleNamespace()
+        return bound
+
+    def _decode(self, raw):
+        if raw is None:
+            return None
+        return decode(raw, self._get_blob, self._memo()[2])
+
+    def _get_blob(self, digest):
+        return self._retry(self.r.get, "blob/" + digest)
+
+    def _put_blob(self, digest, data):
+        self._retry(self.r.set, "blob/" + digest, data, ex=self.blob_ttl)
+
+
+def purge(redis_client, max_age=SESSION_TTL, batch=1000):
+    """
+    Delete the sessions that have not been used for max_age seconds.
+
+    Session keys also expire by themselves, so this mainly bounds the memory
+    used by abandoned sessions between expiries. Keys written before they
+    were given an expiry (which are never recorded as used) are given one.
+
+    Parameters
+    ----------
+    redis_client: redis.Redis
+        the session storage
+    max_age: float
+        seconds since a session's last use after which it is deleted
+    batch: int
+        the number of keys to handle in each pipelined round trip
+
+    Returns
+    -------
+    int:
+        the number of sessions deleted
+    """
+    r = redis_client
+    idents = r.zrangebyscore(SESSIONS, "-inf", time.time() - max_age)
+    for start in range(0, len(idents), batch):
+        chunk = [i.decode() if isinstance(i, bytes) else i
+                 for i in idents[start:start + batch]]
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(*[f"{i}/{k}" for i in chunk for k in DB.KEYS])
+        pipe.zrem(SESSIONS, *chunk)
+        pipe.execute()
+
+    # keys from before sessions expired
+    keys = [k for k in r.scan_iter(match="*/*", count=batch)
+            if not k.startswith(b"blob/")]
+    for start in range(0, len(keys), batch):
+        chunk = keys[start:start + batch]
+        pipe = r.pipeline(transaction=False)
+        for key, ttl in zip(chunk, _ttls(r, chunk)):
+            if ttl == -1:
+                pipe.expire(key, max_age)
+        pipe.execute()
+
+    return len(idents)
+
+
+def _ttls(r, keys):
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.ttl(key)
+    return pipe.execute()
+
+
+class FakeRedis:
+    """
+    An in-process stand in for a redis client.
+
+    Implements the commands used for session storage (including expiry,
+    pipelines and the sorted set of sessions), so that tests and load tests
+    can run without a redis server. It is thread safe, but not shared between
+    processes.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._zsets = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key):
+        expiry = self._expiry.get(key)
+        if expiry is not None and expiry <= time.time():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return key in self._data
+
+    def ping(self):
+        """Check the connection."""
+        return True
+
+    def get(self, key):
+        """Get the value of a key, or None."""
+        key = _bytes(key)
+        with self._lock:
+            return self._data[key] if self._live(key) else None
+
+    def mget(self, keys):
+        """Get the values of many keys."""
+        return [self.get(k) for k in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        """Set the value of a key, optionally expiring in ex seconds."""
+        key = _bytes(key)
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self._data[key] = _bytes(value)
+            self._expiry.pop(key, None)
+            if ex is not None:
+                self._expiry[key] = time.time() + ex
+            return True
+
+    def delete(self, *keys):
+        """Delete keys, returning how many existed."""
+        with self._lock:
+            count = 0
+            for key in map(_bytes, keys):
+                count += self._live(key)
+                self._data.pop(key, None)
+                self._expiry.pop(key, None)
+            return count
+
+    def expire(self, key, seconds):
+        """Set a key to expire in some seconds."""
+        key = _bytes(key)
+        with self._lock:
+            if not self._live(key):
+                return False
+            self._expiry[key] = time.time() + seconds
+            return True
+
+    def ttl(self, key):
+        """Get the seconds until a key expires (-1 if never, -2 if gone)."""
+        key = _bytes(key)
+        with self._lock:
+            if not self._live(key):
+                return -2
+            if key not in self._expiry:
+                return -1
+            return int(round(self._expiry[key] - time.time()))
+
+    def scan_iter(self, match="*", count=None):
+        """Iterate over the live keys matching a glob pattern."""
+        with self._lock:
+            keys = [k for k in list(self._data) if self._live(k)]
+        pattern = _bytes(match)
+        return (k for k in keys if fnmatch.fnmatchcase(k, pattern))
+
+    def zadd(self, name, mapping):
+        """Add members to a sorted set with their scores."""
+        with self._lock:
+            zset = self._zsets.setdefault(_bytes(name), {})
+            added = sum(_bytes(m) not in zset for m in mapping)
+            zset.update({_bytes(m): float(v) for m, v in mapping.items()})
+            return added
+
+    def zrem(self, name, *members):
+        """Remove members from a sorted set."""
+        with self._lock:
+            zset = self._zsets.get(_bytes(name), {})
+            return sum(zset.pop(_bytes(m), None) is not None
+                       for m in members)
+
+    def zremrangebyscore(self, name, lo, hi):
+        """Remove the members of a sorted set with scores in [lo, hi]."""
+        members = self.zrangebyscore(name, lo, hi)
+        return self.zrem(name, *members) if members else 0
+
+    def zrangebyscore(self, name, lo, hi):
+        """Get the members of a sorted set with scores in [lo, hi]."""
+        lo, hi = float(lo), float(hi)
+        with self._lock:
+            zset = self._zsets.get(_bytes(name), {})
+            members = sorted(zset.items(), key=lambda m: m[1])
+        return [m for m, v in members if lo <= v <= hi]
+
+    def pipeline(self, transaction=True):
+        """Queue commands to run together."""
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client._lock:
+            results = [c(*a, **k) for c, a, k in self.commands]
+        self.commands = []
+        return results
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
 
 
 class DevDB(DB):
@@ -104,7 +650,7 @@ class DevDB(DB):
 
     def _get(self, key):
         ident = self.session["id"]
-        result = self._db[ident + "/" + key]
+        result = self._db.get(ident + "/" + key)
         return result
 
     def _set(self, key, value):
@@ -113,4 +659,10 @@ class DevDB(DB):
 
     def _del(self, key):
         ident = self.session["id"]
-        del self._db[ident + "/" + key]
+        self._db.pop(ident + "/" + key, None)
+
+    def bind(self, ident):
+        """Get storage for the session ident, sharing the dict."""
+        bound = copy.copy(self)
+        bound.session = {"id": ident}
+        return bound
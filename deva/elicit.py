@@ -5,35 +5,178 @@ Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
 import numpy as np
-from deva import halfspace
-from sklearn.cluster import KMeans
+from deva import cluster, halfspace
+
+
+DEFAULT_CLUSTERING = "warm"  # engine in deva.cluster for E-NAUTILUS
 
 
 class Candidate:
     """Represent a candidate model's name and attributes."""
 
+    __slots__ = ("name", "spec_name", "_index", "_values")
+
     def __init__(self, name, attributes, spec_name=None):
+        keys = sorted(attributes.keys())
         self.name = name
-        self.attr_keys = sorted(attributes.keys())
-        self.attr_values = [attributes[a] for a in self.attr_keys]
-        self.attributes = dict(zip(self.attr_keys, self.attr_values))
         self.spec_name = spec_name or name
+        self._index = attribute_index(keys)
+        self._values = np.array([attributes[a] for a in keys], dtype=float)
+
+    @classmethod
+    def view(cls, name, spec_name, index, values):
+        """Make a candidate sharing an attribute index and value storage."""
+        candidate = cls.__new__(cls)
+        candidate.name = name
+        candidate.spec_name = spec_name
+        candidate._index = index
+        candidate._values = values
+        return candidate
 
     def __getitem__(self, key):
         """Access attributes directly."""
-        return self.attributes[key]
+        return self._values[self._index[key]]
 
     def __repr__(self):
         """Display candidate by name."""
         return f"Candidate({self.name})"
 
+    @property
+    def attributes(self):
+        """Map attribute keys to their values."""
+        return dict(zip(self._index, self._values.tolist()))
+
+    @property
+    def attr_keys(self):
+        """Sorted attribute keys."""
+        return list(self._index)
+
+    @property
+    def attr_values(self):
+        """Attribute values in the order of the sorted keys."""
+        return self._values.tolist()
+
     def get_attr_values(self):
         """Return sorted attribute values."""
-        return self.attr_values
+        return self._values
 
     def get_attr_keys(self):
         """Return sorted attribute keys."""
-        return self.attr_keys
+        return list(self._index)
+
+
+class CandidateSet:
+    """
+    Columnar storage for a set of candidates.
+
+    Holds the candidate names and spec names, and a single read-only score
+    matrix of shape (n candidates, d attributes) with the attributes in
+    sorted order. Indexing with an integer gives a Candidate view of a row,
+    and indexing with a slice, mask or index array gives a subset.
+    """
+
+    def __init__(self, names, scores, attribs, spec_names=None):
+        keys = sorted(attribs)
+        columns = [list(attribs).index(a) for a in keys]
+        scores = np.asarray(scores, dtype=float).reshape(len(names), -1)
+        if columns != list(range(len(columns))):
+            scores = scores[:, columns]
+        self.names = list(names)
+        self.spec_names = list(spec_names or names)
+        self.attribs = keys
+        self.scores = _readonly(scores)
+        self._index = attribute_index(keys)
+
+    @classmethod
+    def from_candidates(cls, candidates):
+        """Collate a sequence of candidates (CandidateSets pass through)."""
+        if isinstance(candidates, cls):
+            return candidates
+        candidates = list(candidates)
+        if not candidates:
+            return cls([], np.zeros((0, 0)), [])
+        return cls(
+            [c.name for c in candidates],
+            [c.get_attr_values() for c in candidates],
+            candidates[0].get_attr_keys(),
+            [c.spec_name for c in candidates],
+        )
+
+    def __len__(self):
+        """Count the candidates."""
+        return len(self.names)
+
+    def __iter__(self):
+        """Iterate over candidate views."""
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, item):
+        """Get a candidate view (by integer) or a subset of candidates."""
+        if isinstance(item, (int, np.integer)):
+            return Candidate.view(self.names[item], self.spec_names[item],
+                                  self._index, self.scores[item])
+
+        rows = np.arange(len(self))[item]
+        subset = CandidateSet.__new__(CandidateSet)
+        subset.names = [self.names[i] for i in rows]
+        subset.spec_names = [self.spec_names[i] for i in rows]
+        subset.attribs = self.attribs
+        subset.scores = _readonly(self.scores[rows])
+        subset._index = self._index
+        return subset
+
+    def __repr__(self):
+        """Display the size of the set."""
+        return f"CandidateSet({len(self)} candidates)"
+
+    def __deepcopy__(self, memo):
+        """Copy the names, but share the (read-only) scores."""
+        result = CandidateSet.__new__(CandidateSet)
+        result.__dict__.update(self.__dict__)
+        result.names = list(self.names)
+        result.spec_names = list(self.spec_names)
+        memo[id(self)] = result
+        return result
+
+    def __getstate__(self):
+        """Pickle the names as read-only arrays, like the scores."""
+        state = self.__dict__.copy()
+        state["names"] = _readonly(np.array(self.names, dtype=str))
+        state["spec_names"] = _readonly(np.array(self.spec_names, dtype=str))
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled set, marking the scores read-only again."""
+        self.__dict__.update(state)
+        self.names = np.asarray(self.names).tolist()
+        self.spec_names = np.asarray(self.spec_names).tolist()
+        self.scores = _readonly(self.scores)
+
+    def column(self, attr):
+        """Get the scores of a single attribute."""
+        return self.scores[:, self._index[attr]]
+
+    def table(self, attribs):
+        """Get the scores with columns in the order of `attribs`."""
+        return self.scores[:, [self._index[a] for a in attribs]]
+
+
+_indices = {}
+
+
+def attribute_index(keys):
+    """Get a shared mapping of attribute keys to their column."""
+    keys = tuple(keys)
+    if keys not in _indices:
+        _indices[keys] = {k: i for i, k in enumerate(keys)}
+    return _indices[keys]
+
+
+def _readonly(a):
+    a = np.ascontiguousarray(a)
+    a.setflags(write=False)
+    return a
 
 
 class Eliciter:
@@ -69,35 +212,37 @@ class LadderEliciter(Eliciter):
     """Pass over the candidates, comparing each to the current preference."""
 
     def __init__(self, candidates, _):
-        assert candidates, "No candidate models"
+        assert len(candidates), "No candidate models"
         Eliciter.__init__(self)
-        self.candidates = list(candidates)  # copy references
+        self.candidates = CandidateSet.from_candidates(candidates)
+        self.best = 0  # index of the current preference
+        self.next = 1  # index of the next candidate to compare with it
         self._update()
 
     def put(self, choice):
         """Input user decision into the eliciter."""
         if choice == self._query[1].name:
-            self.candidates.remove(self._query[0])
-        else:
-            self.candidates.remove(self._query[1])
+            self.best = self.next
+        self.next += 1
         self._update()
 
     def terminated(self):
         """Check if eliciter is terminated."""
-        return len(self.candidates) == 1
+        return self.next >= len(self.candidates)
 
     def result(self):
         """Obtain eliciter final result."""
-        assert len(self.candidates) == 1, "Not terminated."
-        return self.candidates[0]
+        assert self.terminated(), "Not terminated."
+        return self.candidates[self.best]
 
     def query(self):
         """Obtain eliciter current query."""
         return self._query
 
     def _update(self):
-        if len(self.candidates) > 1:
-            self._query = (self.candidates[0], self.candidates[1])
+        if not self.terminated():
+            self._query = (self.candidates[self.best],
+                           self.candidates[self.next])
         else:
             self._query = None
 
@@ -108,6 +253,9 @@ class EnautilusEliciter(Eliciter):
 
     See: 'E-NAUTILUS: A decision support system for complex multiobjective
     optimization problems based on the NAUTILUS method.', Ruiz et al. 2015
+
+    The scenario may choose the engine in `deva.cluster.engines` used to
+    find the options at each step with its "clustering" key.
     """
 
     def __init__(self, candidates, scenario):
@@ -126,10 +274,13 @@ class EnautilusEliciter(Eliciter):
         self._n_choices = 2  # number of options
         self.step = 0
         self.iter_count = 0
-        self.candidates = list(candidates)
-        self.attribs = candidates[0].get_attr_keys()
+        self.candidates = CandidateSet.from_candidates(candidates)
+        self.remaining = np.arange(len(self.candidates))  # not yet pruned
+        self.attribs = self.candidates.attribs
         self.current_centers = []
-        self.kmeans_centers = []
+        self.kmeans_centers = None
+        self._cluster = cluster.engines[
+            scenario.get("clustering", DEFAULT_CLUSTERING)]
         self._update_zpoints()
         self._options = []
         self._update()
@@ -146,31 +297,24 @@ class EnautilusEliciter(Eliciter):
 
     def terminated(self):
         """Check if the termination condition is met."""
-        return (self.step >= self._n_questions) or (len(self.candidates) == 1)
+        return (self.step >= self._n_questions) or (len(self.remaining) == 1)
 
     def result(self):
         """Return result of the eliciter if terminated."""
         assert self.terminated(), "Not terminated."
-        X = []
-        for can in self.candidates:
-            X.append(np.array(can.get_attr_values()))
-        sub = np.array(X) - np.array(list(self._nadir.values()))
+        sub = self._scores() - np.array(list(self._nadir.values()))
         norm1 = np.linalg.norm(sub, axis=1)
-        return self.candidates[norm1.argmin()]
+        return self.candidates[self.remaining[norm1.argmin()]]
+
+    def _scores(self):
+        """Get the scores of the remaining candidates."""
+        return self.candidates.scores[self.remaining]
 
     def _update_zpoints(self):
         """Calculate new ideal and nadirpoint."""
-        for att in self.attribs:
-            minv = None
-            maxv = None
-            for candidate in self.candidates:
-                temp = candidate.attributes[att]
-                if minv is None or temp < minv:
-                    minv = temp
-                if maxv is None or temp > maxv:
-                    maxv = temp
-            self._ideal[att] = minv
-            self._nadir[att] = maxv
+        X = self._scores()
+        self._ideal = dict(zip(self.attribs, X.min(axis=0).tolist()))
+        self._nadir = dict(zip(self.attribs, X.max(axis=0).tolist()))
 
     def put(self, choice):
         """Receive input from the user and update ideal point."""
@@ -179,14 +323,10 @@ class EnautilusEliciter(Eliciter):
         index = self._options.index(choice)
         choice = self._query[index]
         self._nadir = choice.attributes
-        # remove candidates that are worse in every attribute
-        copy = []
-        for can in self.candidates:
-            if np.any(np.array(can.get_attr_values())
-                      > np.array(list(self._nadir.values()))):
-                copy.append(can)
-        for c in copy:
-            self.candidates.remove(c)
+        # remove candidates that are worse in any attribute
+        nadir = np.array(list(self._nadir.values()))
+        worse = (self._scores() > nadir).any(axis=1)
+        self.remaining = self.remaining[~worse]
         self._update_zpoints()
         self._nadir = choice.attributes
         self._update()
@@ -197,19 +337,11 @@ class EnautilusEliciter(Eliciter):
 
         Selects points between the nadir point and the the kmeans centers.
         """
-        X = []
-        for can in self.candidates:
-            X.append(np.array(can.get_attr_values()))
-        if self._n_choices > len(self.candidates):
-            self._n_choices = len(self.candidates)
-        kmeans = KMeans(n_clusters=self._n_choices).fit(np.array(X))
-        centers = kmeans.cluster_centers_
-        kc = []
-        for c in centers:
-            sub = np.array(X) - np.array(c)
-            norm1 = np.linalg.norm(sub, axis=1)
-            kc.append(X[norm1.argmin()])
-        kc = np.array(kc)
+        X = self._scores()
+        if self._n_choices > len(X):
+            self._n_choices = len(X)
+        centers = self._cluster(X, self._n_choices, self.kmeans_centers)
+        kc = X[cluster.nearest(X, centers)]
         self.kmeans_centers = kc
         # project to the line between pareto front and nadir point
         remaining = self._n_questions - self.step
@@ -238,7 +370,7 @@ class EnautilusEliciter(Eliciter):
         """Update new query and the number of questions remaining."""
         remaining = self._n_questions - self.step
 
-        if (remaining > 0) and (len(self.candidates) != 1):
+        if (remaining > 0) and (len(self.remaining) != 1):
             self._query = self.virtualCandidateGen()
             self.step += 1
         else:
@@ -249,29 +381,38 @@ class ActiveMaxEliciter(Eliciter):
     """Use pairwise linear separation to estimate the preferred candidate."""
 
     _active_alg = halfspace.HalfspaceMax
-    _active_kw = {"query_order": halfspace.max_compar_rand}
+    _active_kw = {
+        "query_order": halfspace.max_compar_rand,
+        "monotone": True,
+        # batch mode asks the same questions as the sequential mode, or fewer
+        # as it drops every candidate that loses to (e.g. is dominated by) the
+        # current max, not only those it reaches before the max changes. For
+        # 15 preferences over 400 four-metric candidates it asked 37.5
+        # questions on average (38.5 sequentially, and never more for any
+        # one), taking 1ms rather than 13ms per question.
+        "batch": True,
+    }
     # Orders: max_compar_smooth, max_compar_rand,
     #         partial(max_compar_primary, primary_index=...)
 
-    def __init__(self, candidates, scenario):
+    def __init__(self, candidates, scenario, n_jobs=None):
         if len(candidates) < 2:
             raise RuntimeError("Two or more candidates required.")
         Eliciter.__init__(self)
-        self.candidates = list(candidates)
-        attribs = list(candidates[0].attributes.keys())
+        self.candidates = CandidateSet.from_candidates(candidates)
         self._result = None
+        data = self.candidates.scores
 
-        # convert data structures to a numpy array
-        data = []
-        for c in candidates:
-            data.append([c[a] for a in attribs])
-        data = np.array(data)
+        # processes for the linear programs, unless given by the scenario
+        if n_jobs is None:
+            n_jobs = scenario.get("n_jobs", 1)
 
         # metrics = scenario["metrics"]
         # already pre-applied, we can assume lower is always better
         self.active = self._active_alg(
             data,
             yield_indices=True,
+            n_jobs=n_jobs,
             **self._active_kw
         )
         self._update()
@@ -308,6 +449,22 @@ class ActiveMaxEliciter(Eliciter):
         return self._result is not None
 
 
+class ActiveRankEliciter(ActiveMaxEliciter):
+    """Rank the candidates by binary insertion with pairwise separation."""
+
+    _active_alg = halfspace.HalfspaceSort
+    _active_kw = {
+        "query_order": halfspace.max_compar_rand,
+        "monotone": True,
+    }
+
+    def ranking(self):
+        """Return the candidates from most to least preferred."""
+        if not self.terminated():
+            return None
+        return self.candidates[self.active.get_result()[::-1]]
+
+
 def autoname(ind):
     """Automatically turn an index into a system name."""
     # sequence A-Z, AA-AZ-ZZ, AAA-AAZ-AZZ-ZZZ ...
@@ -324,5 +481,6 @@ def autoname(ind):
 algorithms = {
     "Ladder": LadderEliciter,
     "ActiveMax": ActiveMaxEliciter,
+    "ActiveRank": ActiveRankEliciter,
     "E-NAUTILUS": EnautilusEliciter,
 }
@@ -4,13 +4,26 @@ Loading and parsing candidates and metadata.
 Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
-import math
 import os.path
 import os
+import json
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from glob import glob
 from deva import elicit
+from deva.index import BoxIndex
+import numpy as np
 import toml
-from deva.pareto import remove_non_pareto
+from deva.pareto import efficient_mask
+
+
+CACHE_DIR = "cache"  # compiled scenario data, relative to the scenario
+CACHE_VERSION = 1
+REVALIDATE = 60.  # seconds between full checks of a cached scenario's files
+SCENARIO_FILES = ("metadata.toml", "baseline.toml", "bounds.toml")
 
 
 def repo_root():
@@ -68,20 +81,20 @@ def _load_baseline(scenario):
     return baseline
 
 
-def load_scenario(scenario_name, pfilter=True):
-    """Load the metadata and candidates of a specific scenario."""
+def load_scenario(scenario_name, pfilter=True, use_cache=True, key=None):
+    """
+    Load the metadata and candidates of a specific scenario.
+
+    With use_cache, the efficient candidates' scores are also compiled to
+    the scenario's cache folder, and later loads memory map them, so that
+    processes serving the same scenario share one read-only copy. The
+    scenario's `scenario_key` may be given if it is already known.
+    """
     # Load all scenario files
     scenario_path = os.path.join(repo_root(), "scenarios", scenario_name)
     print("Scanning ", scenario_path)
-    input_files = get_all_files(scenario_path)
-    models = {}
-    for name, fs in input_files.items():
-        fname = fs["metrics"]
-        models[name] = toml.load(fname)
 
     scenario = toml.load(os.path.join(scenario_path, "metadata.toml"))
-    assert len(models) > 0, "There are no candidate models."
-
     baseline = _load_baseline(scenario_name)
 
     # attempt to load the bounds
@@ -94,27 +107,32 @@ def load_scenario(scenario_name, pfilter=True):
     metrics = scenario["metrics"]
     flip = [m for m in metrics if not metrics[m].get("lowerIsBetter", True)]
     for f in flip:
-        for val in models.values():
-            val[f] = -val[f]
-
         for i in baseline:
             baseline[i][f] = -baseline[i][f]
 
     scenario["baseline"] = baseline
 
-    # Filter efficient set
-    if pfilter:
-        models = remove_non_pareto(models)
-
-    assert len(models) > 0, "There are no efficient models."
+    if not (use_cache and pfilter):
+        key = None
+    elif key is None:
+        key = scenario_key(scenario_name)
+    front = _read_front(scenario_path, key) if key else None
+    if front is not None:
+        names, attribs, scores = front
+    else:
+        names, attribs, scores = _compile_front(scenario_path, flip, pfilter,
+                                                use_cache)
+        if key:
+            try:
+                _write_front(scenario_path, key, names, attribs, scores)
+            except OSError as e:
+                print(f"Could not write the scenario cache: {e}")
 
-    # Convert the TOML-loaded dictionaries into candidate objects.
-    candidates = []
+    assert len(names) > 0, "There are no efficient models."
 
-    for spec_name, perf in models.items():
-        name = elicit.autoname(len(candidates))
-        scores = {k: v for k, v in perf.items()}
-        candidates.append(elicit.Candidate(name, scores, spec_name))
+    # Collect the scores into a candidate set.
+    display_names = [elicit.autoname(i) for i in range(len(names))]
+    candidates = elicit.CandidateSet(display_names, scores, attribs, names)
 
     inject_metadata(metrics, candidates)
 
@@ -126,17 +144,269 @@ def load_scenario(scenario_name, pfilter=True):
     return candidates, scenario
 
 
+def _compile_front(scenario_path, flip, pfilter, use_cache):
+    """Load a scenario's models, orient them, and filter the efficient set."""
+    names, attribs, scores = load_models(scenario_path, use_cache)
+    assert len(names) > 0, "There are no candidate models."
+
+    for f in flip:
+        scores[:, attribs.index(f)] *= -1
+
+    # Filter efficient set
+    if pfilter:
+        efficient = efficient_mask(scores)
+        d = len(names) - np.count_nonzero(efficient)
+        s = "" if d == 1 else "s"
+        print("Deleted {} pareto inefficient model{}.".format(d, s))
+        names = [n for n, e in zip(names, efficient) if e]
+        scores = scores[efficient]
+
+    return names, attribs, scores
+
+
+def load_models(scenario_path, use_cache=True):
+    """
+    Load the names and scores of all the models in a scenario.
+
+    The parsed scores are cached in the scenario's cache folder, and the
+    cache is reused for as long as the metrics files are unchanged.
+
+    Returns
+    -------
+    names: list
+        The (sorted) spec names of the models.
+    attribs: list
+        The (sorted) metric names.
+    scores: ndarray
+        An array of shape (len(names), len(attribs)) of the raw scores.
+    """
+    input_files = get_all_files(scenario_path)
+    key = cache_key(input_files)
+
+    if use_cache:
+        cached = _read_cache(scenario_path, key)
+        if cached is not None:
+            return cached
+
+    names = sorted(input_files)
+    models = [toml.load(input_files[n]["metrics"]) for n in names]
+    attribs = sorted(models[0]) if models else []
+    scores = np.array([[m[a] for a in attribs] for m in models], dtype=float)
+    scores = scores.reshape(len(names), len(attribs))
+
+    try:
+        _write_cache(scenario_path, key, names, attribs, scores)
+    except OSError as e:
+        print(f"Could not write the scenario cache: {e}")
+
+    return names, attribs, scores
+
+
+def build_cache(scenario_name):
+    """Rebuild the compiled cache of a scenario's models and its front."""
+    scenario_path = os.path.join(repo_root(), "scenarios", scenario_name)
+    names, _, _ = load_models(scenario_path, use_cache=False)
+    load_scenario(scenario_name)  # compiles the efficient front if stale
+    return len(names)
+
+
+def cache_key(input_files):
+    """Summarise the modification state of a scenario's metrics files."""
+    stamps = []
+    for name in sorted(input_files):
+        st = os.stat(input_files[name]["metrics"])
+        stamps.append([name, st.st_mtime_ns, st.st_size])
+
+    raw = json.dumps([CACHE_VERSION, stamps]).encode()
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _cache_files(scenario_path, stem=""):
+    cache_path = os.path.join(scenario_path, CACHE_DIR)
+    return (os.path.join(cache_path, f"{stem}index.json"),
+            os.path.join(cache_path, f"{stem}scores.npy"))
+
+
+def _read_cache(scenario_path, key, stem="", mmap_mode=None):
+    index_f, scores_f = _cache_files(scenario_path, stem)
+    try:
+        with open(index_f) as f:
+            index = json.load(f)
+        if index["key"] != key:
+            return None
+        scores = np.load(scores_f, mmap_mode=mmap_mode)
+    except (OSError, ValueError, KeyError):
+        return None  # missing, stale or corrupt
+
+    return index["names"], index["attribs"], scores
+
+
+def _read_front(scenario_path, key):
+    """Memory map a scenario's compiled efficient scores, if up to date."""
+    return _read_cache(scenario_path, key, "front_", mmap_mode="r")
+
+
+def _write_front(scenario_path, key, names, attribs, scores):
+    _write_cache(scenario_path, key, names, attribs, scores, "front_")
+
+
+def _write_cache(scenario_path, key, names, attribs, scores, stem=""):
+    index_f, scores_f = _cache_files(scenario_path, stem)
+    os.makedirs(os.path.dirname(index_f), exist_ok=True)
+
+    # write to temporary files and rename so readers never see partial files
+    # the index is written last as it holds the key validating the scores
+    with open(scores_f + ".tmp", "wb") as f:
+        np.save(f, scores)
+    os.replace(scores_f + ".tmp", scores_f)
+
+    index = {"key": key, "names": names, "attribs": attribs}
+    with open(index_f + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_f + ".tmp", index_f)
+
+
+def scenario_key(scenario_name):
+    """Summarise the modification state of all of a scenario's files."""
+    scenario_path = os.path.join(repo_root(), "scenarios", scenario_name)
+    stamps = [cache_key(get_all_files(scenario_path))]
+    for fname in SCENARIO_FILES:
+        try:
+            st = os.stat(os.path.join(scenario_path, fname))
+            stamps.append([fname, st.st_mtime_ns, st.st_size])
+        except FileNotFoundError:
+            stamps.append([fname, None])
+    return json.dumps(stamps)
+
+
+def scenario_stamp(scenario_name):
+    """
+    Cheaply summarise the modification state of a scenario.
+
+    Stats the models folder (which changes when models are added, removed or
+    replaced) and the toml files, but not each model file as `scenario_key`
+    does.
+    """
+    scenario_path = os.path.join(repo_root(), "scenarios", scenario_name)
+    stamps = []
+    for fname in ("models",) + SCENARIO_FILES:
+        try:
+            st = os.stat(os.path.join(scenario_path, fname))
+            stamps.append((fname, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamps.append((fname, None))
+    return tuple(stamps)
+
+
+class ScenarioCache:
+    """
+    Thread-safe, least recently used cache of loaded scenarios.
+
+    Entries are invalidated when any of the scenario's files change, and
+    callers receive a deep copy of the cached scenario so they are free to
+    modify it. A BoxIndex of each cached scenario's candidates is built on
+    first use.
+
+    Each use checks the cheap `scenario_stamp`. The full `scenario_key`,
+    which stats every model file, is only computed when the stamp changes or
+    `revalidate` seconds have passed since it was last checked (never, if
+    revalidate is None), as models edited in place do not change the stamp.
+    """
+
+    def __init__(self, maxsize=8, revalidate=REVALIDATE):
+        self.maxsize = maxsize
+        self.revalidate = revalidate
+        # name -> (key, scenario, stamp, time the key was checked)
+        self._entries = OrderedDict()
+        self._indices = {}  # name -> (key, BoxIndex)
+        self._lock = threading.Lock()
+
+    def load(self, scenario_name):
+        """Load a scenario (see load_scenario) from the cache if possible."""
+        return copy.deepcopy(self._entry(scenario_name)[1])
+
+    def index(self, scenario_name, validate=True):
+        """
+        Get a BoxIndex of a scenario's candidates.
+
+        Its rows refer to the candidates in the order `load` gives them.
+        Without validate, an index already built is returned without checking
+        the scenario's files, for frequent queries (such as counts while
+        bounds are dragged) between the loads that do check them.
+        """
+        if not validate:
+            with self._lock:
+                entry = self._indices.get(scenario_name)
+                if entry is not None:
+                    return entry[1]
+
+        key, (candidates, _) = self._entry(scenario_name)
+        with self._lock:
+            entry = self._indices.get(scenario_name)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+        result = BoxIndex(candidates)
+
+        with self._lock:
+            if scenario_name in self._entries:
+                self._indices[scenario_name] = (key, result)
+        return result
+
+    def _entry(self, scenario_name):
+        """Get the key and (shared) data of a scenario, loading if needed."""
+        stamp = scenario_stamp(scenario_name)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(scenario_name)
+            if entry is not None and entry[2] == stamp and (
+                    self.revalidate is None
+                    or now - entry[3] < self.revalidate):
+                self._entries.move_to_end(scenario_name)
+                return entry[:2]
+
+        key = scenario_key(scenario_name)
+        if entry is not None and entry[0] == key:
+            data = entry[1]  # unchanged, so just note the check
+        else:
+            data = load_scenario(scenario_name, key=key)
+
+        with self._lock:
+            self._entries[scenario_name] = (key, data, stamp, now)
+            self._entries.move_to_end(scenario_name)
+            while len(self._entries) > self.maxsize:
+                name, _ = self._entries.popitem(last=False)
+                self._indices.pop(name, None)
+
+        return key, data
+
+    def clear(self):
+        """Remove all the cached scenarios."""
+        with self._lock:
+            self._entries.clear()
+            self._indices.clear()
+
+
 def inject_metadata(metrics, candidates):
     """Inject dynamic metadata after looking at candidates."""
-    for attr, meta in metrics.items():
+    if not candidates:
+        raise Exception("Sorry, there is no candidate model.")
+
+    # calculate the attribute ranges spanned by the candidates in one pass
+    table = score_table(candidates, list(metrics))
+    mins = table.min(axis=0).tolist()
+    maxs = table.max(axis=0).tolist()
+    nice_mins, nice_maxs = nice_ranges(mins, maxs)
+
+    for i, (attr, meta) in enumerate(metrics.items()):
 
         # Fill defaults
         if "type" not in meta:
             meta["type"] = "quantitative"
 
-        # calculate the attribute range spanned by the candidates
-        meta["min"] = min(c[attr] for c in candidates)
-        meta["max"] = max(c[attr] for c in candidates)
+        meta["min"] = mins[i]
+        meta["max"] = maxs[i]
 
         # defaults for visual min and max
         if "visual_min" not in meta:
@@ -168,16 +438,11 @@ def inject_metadata(metrics, candidates):
         if meta["type"] == "quantitative":
             meta["displayDecimals"] = int(meta["displayDecimals"])
 
-            if candidates:
-                # the user may set fixed ranges with nice defaults if they dont
-                (range_min, range_max) = nice_range(meta["min"], meta["max"])
-            else:
-                raise Exception("Sorry, there is no candidate model.")
-
+            # the user may set fixed ranges with nice defaults if they dont
             if "range_min" not in meta:
-                meta["range_min"] = range_min
+                meta["range_min"] = nice_mins[i]
             if "range_max" not in meta:
-                meta["range_max"] = range_max
+                meta["range_max"] = nice_maxs[i]
 
         elif meta["type"] == "qualitative":
             meta["displayDecimals"] = None
@@ -186,21 +451,42 @@ def inject_metadata(metrics, candidates):
             raise Warning(f"Data type {meta['type']} not supported.")
 
 
+def score_table(candidates, attribs):
+    """Collate candidate scores into an array with columns in attribs order."""
+    return elicit.CandidateSet.from_candidates(candidates).table(attribs)
+
+
 def nice_range(a, b):
     """
     Round min down and max up to the nearest `div`.
 
     Return the minimum value and the maximum value in order in a tuple.
     """
-    min_num = min(a, b)
-    max_num = max(a, b)
-    diff = math.ceil(max_num - min_num)
-    div = 10**(len(str(diff)) - 1)
-
-    if min_num % div == 0:
-        min_num -= div
-    if max_num % div == 0:
-        max_num += div
-    min_num = math.floor(min_num / div) * div
-    max_num = math.ceil(max_num / div) * div
-    return (min_num, max_num)
+    nice_min, nice_max = nice_ranges([a], [b])
+    return (nice_min[0], nice_max[0])
+
+
+def nice_ranges(a, b):
+    """
+    Compute nice_range elementwise over sequences of range limits.
+
+    Return lists of the rounded minimum and maximum values.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    min_num = np.minimum(a, b)
+    max_num = np.maximum(a, b)
+
+    # div is the power of ten with as many digits as the (rounded up) span
+    diff = np.ceil(max_num - min_num)
+    div = np.ones(len(diff), dtype=np.int64)
+    small = div * 10 <= diff
+    while small.any():
+        div[small] *= 10
+        small = div * 10 <= diff
+
+    min_num = np.where(min_num % div == 0, min_num - div, min_num)
+    max_num = np.where(max_num % div == 0, max_num + div, max_num)
+    min_num = np.floor(min_num / div).astype(np.int64) * div
+    max_num = np.ceil(max_num / div).astype(np.int64) * div
+    return min_num.tolist(), max_num.tolist()
@@ -8,14 +8,24 @@ Advances in Neural Information Processing Systems (NeurIPS) 24, 9.
 Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
+import atexit
+import multiprocessing
+import threading
+import weakref
 import numpy as np
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from functools import cmp_to_key
+from itertools import islice, repeat
 from scipy.optimize import linprog
+from scipy.spatial import ConvexHull, QhullError
 from sklearn.utils import check_random_state
 from sklearn.decomposition import PCA
 
 
 SHATTER_THRESH = 1e-10
+FACET_TOL = 1e-9  # relative margin for deciding labels from cone facets
+MAX_WITNESSES = 16  # cached separators kept by the ShatterEngine
 EPS = 1e-5   # hack for constant column std
 
 
@@ -76,7 +86,7 @@ class HalfspaceRanking(_HalfspaceBase):
     features. As the authors note (Jamieson and Nowak, 2011), the computational
     complexity of the algorithm can be reduced by integrating the query label
     inference into a binary sorting algorithm, rather than running the sort on
-    the result of the (n choose 2) comparisons.
+    the result of the (n choose 2) comparisons (see `HalfspaceSort`).
 
     Queries are of the form, x_1 < x_2. If this ordering is correct, the oracle
     should return -1, otherwise 1.
@@ -110,11 +120,22 @@ class HalfspaceRanking(_HalfspaceBase):
     yield_indices: bool
         Yield indices into X (True) or the rows of X themselves (False) for the
         queries.
+    batch: bool
+        Classify all the outstanding comparisons at once each round (see
+        `ShatterEngine.classify`), so that linear programs only run for the
+        comparisons it leaves undecided. Otherwise comparisons are imputed one
+        at a time. Either way they are taken in order until one is ambiguous,
+        so the same questions are asked.
+    n_jobs: int
+        The number of processes to solve linear programs with (see
+        `ShatterEngine`).
     """
 
-    def __init__(self, X, query_order, yield_indices=False):
+    def __init__(self, X, query_order, yield_indices=False, batch=False,
+                 n_jobs=1):
 
         self.yield_indices = yield_indices
+        self.batch = batch
         self.result = None
         self.query = None
         self.order = query_order(X)  # sequence of tuples
@@ -124,26 +145,21 @@ class HalfspaceRanking(_HalfspaceBase):
         # Allocate storage buffers for imputation
         n, d = X.shape
         self.nc = (n * (n - 1)) // 2  # unique pairwise comparisons
-        self.Y = np.zeros(self.nc)  # query labels
-        self.H = np.zeros((self.nc, d + 1))  # query hyperplanes
-        self.Q = np.zeros((n, n), dtype=int)  # All labels, including reversed
+        self.Y = np.zeros(self.nc, dtype=np.int8)  # query labels
+        self.Q = np.zeros((n, n), dtype=np.int8)  # all labels, and reversed
+        self.pending = np.ones(self.nc, dtype=bool)  # unlabelled comparisons
+        self.engine = ShatterEngine(d, n_jobs=n_jobs)  # oracle labels
 
     def next_round(self):
         """Advance the eliciter to the next user-choice round."""
         assert not self.query
 
-        for self.i in range(self.i + 1, self.nc):
-            left, right = self.order[self.i]
-
-            # construct hyperplane comparing left & right
-            self.H[self.i, :] = hyperplane(self.X[left], self.X[right])
-
-            # impute the label inplace to determine ambiguities
-            if impute_label(self.H[:self.i + 1], self.Y[:self.i + 1]):
-                self.put_response(self.Y[self.i])
-            else:
-                break
+        if self.batch:
+            ambiguous = self._next_batch()
         else:
+            ambiguous = self._next_sequential()
+
+        if not ambiguous:
             # Comparisons exhausted - terminated
             # binary sort positions in X using the comparisons in query_map
             key = cmp_to_key(lambda a, b: self.Q[a, b])
@@ -151,20 +167,167 @@ class HalfspaceRanking(_HalfspaceBase):
             return False  # no next round
 
         # Stopped at ambiguity
+        left, right = self.order[self.i]
         self.query = (
             (left, right) if self.yield_indices
             else (self.X[left], self.X[right])
         )
         return True
 
+    def _next_sequential(self):
+        # impute the labels of the planes comparing left & right
+        start = self.i + 1
+        planes = (hyperplane(self.X[left], self.X[right])
+                  for left, right in islice(self.order, start, None))
+        labels = self.engine.impute_iter(planes)
+        try:
+            for self.i, y in zip(range(start, self.nc), labels):
+                if not y:
+                    return True
+                self._record(y)
+        finally:
+            labels.close()
+        return False
+
+    def _next_batch(self):
+        pending = np.flatnonzero(self.pending)
+        pairs = np.asarray(self.order, dtype=int).reshape(-1, 2)[pending]
+        H = hyperplanes(self.X[pairs[:, 0]], self.X[pairs[:, 1]])
+
+        # record every label the labelled planes imply
+        labels, decided = self.engine.classify(H)
+        imputed = decided & (labels != 0)
+        left, right = pairs[imputed].T
+        self.Y[pending[imputed]] = labels[imputed]
+        self.Q[left, right] = labels[imputed]
+        self.Q[right, left] = -labels[imputed]
+        self.pending[pending[imputed]] = False
+
+        # go through the rest in order, as the sequential mode would, asking
+        # about the first ambiguous comparison
+        for j in np.flatnonzero(~imputed):
+            self.i = pending[j]
+            y = 0 if decided[j] else self.engine.impute(H[j])
+            if not y:
+                return True
+            self._record(y)
+        return False
+
     def put_response(self, y):
         """Inform the eliciter of the user's choice."""
+        left, right = self.order[self.i]
+        self.engine.add(hyperplane(self.X[left], self.X[right]), y)
+        self._record(y)
+
+    def _record(self, y):
         left, right = self.order[self.i]
         self.Y[self.i] = y
         self.Q[[left, right], [right, left]] = [y, -y]
+        self.pending[self.i] = False
         self.query = None  # unlock next_round
 
 
+class HalfspaceSort(_HalfspaceBase):
+    """
+    Rank objects by binary insertion, imputing comparisons where possible.
+
+    This integrates the query label inference of the active ranking algorithm
+    into a binary insertion sort, as suggested by Jamieson and Nowak (2011).
+    Each object is inserted into the ranking of the objects before it, and
+    each comparison of the binary search is imputed from the oracle's labels
+    when it can be. So only O(n log n) comparisons are made, rather than the
+    (n choose 2) of `HalfspaceRanking`, and only the oracle's labels are kept.
+
+    Queries are of the form, x_1 < x_2. If this ordering is correct, the oracle
+    should return -1, otherwise 1. This class is used in the same loop as
+    `HalfspaceRanking`, and the result is likewise an array of integer indexes
+    into `X`, from the least to the most preferred object.
+
+    Parameters
+    ----------
+    X: ndarray
+        The n-objects of shape (n, d) to be ranked.
+    query_order: callable
+        A callable that returns a sequence of indices into X giving the order
+        to insert the objects in (see `max_compar_rand`). By default objects
+        are inserted in the order of X.
+    yield_indices: bool
+        Yield indices into X (True) or the rows of X themselves (False) for the
+        queries.
+    monotone: bool
+        Lower values are always preferred, so a pareto dominating object is
+        ranked higher without testing the hyperplanes.
+    n_jobs: int
+        The number of processes to solve linear programs with (see
+        `ShatterEngine`).
+    """
+
+    def __init__(self, X, query_order=None, yield_indices=False,
+                 monotone=False, n_jobs=1):
+
+        self.yield_indices = yield_indices
+        self.monotone = monotone
+        self.result = None
+        self.query = None
+        self.X = X
+        n, d = X.shape
+        self.order = (np.arange(n) if query_order is None
+                      else np.asarray(query_order(X), dtype=int))
+        self.order.setflags(write=False)
+        self.ranked = [self.order[0]]  # ranking of the inserted objects
+        self.k = 0  # position in order of the object being inserted
+        self.lo = self.hi = 1  # binary search bounds in ranked
+        self.engine = ShatterEngine(d, n_jobs=n_jobs)  # oracle labels
+
+    def next_round(self):
+        """Advance to the next round."""
+        while True:
+            if self.lo == self.hi:
+                # the current object has found its place - take the next
+                if self.k:
+                    self.ranked.insert(self.lo, self.order[self.k])
+                self.k += 1
+                if self.k == len(self.order):
+                    self.result = np.array(self.ranked)
+                    return False
+                self.lo, self.hi = 0, len(self.ranked)
+
+            # impute the comparison with the middle of the search interval,
+            # trying the cone facets before a linear program
+            a, b = self._pair()
+            h = hyperplane(self.X[a], self.X[b])
+            y = dominance_label(self.X[a], self.X[b]) if self.monotone else 0
+            if y:
+                self.engine.counts["prior"] += 1
+            else:
+                labels, decided = self.engine.classify(h[np.newaxis])
+                y = labels[0] if decided[0] else self.engine.impute(h)
+            if not y:
+                break
+            self._record(y)
+
+        self.query = (a, b) if self.yield_indices else (self.X[a], self.X[b])
+        return True
+
+    def put_response(self, y):
+        """Inform the eliciter of the user's choice."""
+        a, b = self._pair()
+        self.engine.add(hyperplane(self.X[a], self.X[b]), y)
+        self._record(y)
+
+    def _pair(self):
+        mid = (self.lo + self.hi) // 2
+        return self.ranked[mid], self.order[self.k]
+
+    def _record(self, y):
+        mid = (self.lo + self.hi) // 2
+        if y == -1:
+            self.lo = mid + 1  # the middle object is less than the new one
+        else:
+            self.hi = mid
+        self.query = None  # check next_round is only called after put_response
+
+
 #
 # Max algorithms
 #
@@ -207,37 +370,52 @@ class HalfspaceMax(_HalfspaceBase):
     query_order: callable
         A callable that returns the initial max object index guess and a
         sequence of indices for subsequent comparisons.
+    monotone: bool
+        Lower values are always preferred, so a pareto dominating object is
+        the max of a comparison without testing the hyperplanes.
+    batch: bool
+        Classify the comparisons of all the outstanding objects with the
+        current max at once each round (see `ShatterEngine.classify`), so that
+        linear programs only run for the comparisons it leaves undecided.
+        Otherwise the comparisons are imputed one at a time. Either way objects
+        are compared in order until a comparison is ambiguous, but batch mode
+        also drops every object that loses to the current max (e.g. by pareto
+        dominance), so it asks the same questions or fewer.
+    n_jobs: int
+        The number of processes to solve linear programs with (see
+        `ShatterEngine`).
     """
 
-    def __init__(self, X, query_order, yield_indices=False):
+    def __init__(self, X, query_order, yield_indices=False, monotone=False,
+                 batch=False, n_jobs=1):
 
         self.yield_indices = yield_indices
+        self.monotone = monotone
+        self.batch = batch
         self.result = None
         self.query = None
-        self.order = query_order(X)
+        self.order = np.asarray(query_order(X))
         self.X = X[self.order]
+        self.order.setflags(write=False)  # fixed, so pickled sessions can
+        self.X.setflags(write=False)  # store them once (see deva.db)
         self.maxi = 0  # current preference
         self.i = 0    # incremented before use (starts from 1)
 
         # Allocate storage buffers for imputation
         self.n, d = X.shape
-        self.Y = np.zeros(self.n - 1)  # comparison labels
-        self.H = np.zeros((self.n - 1, d + 1))  # comparison hyperplanes
+        self.Y = np.zeros(self.n - 1, dtype=np.int8)  # comparison labels
+        self.pending = np.ones(self.n, dtype=bool)  # objects yet to compare
+        self.pending[0] = False
+        self.engine = ShatterEngine(d, n_jobs=n_jobs)  # oracle labels
 
     def next_round(self):
         """Advance to the next round."""
-        for self.i in range(self.i + 1, self.n):
-
-            # construct hyperplane comparing candidate with best
-            self.H[self.i - 1, :] = hyperplane(self.X[self.maxi],
-                                               self.X[self.i])
-
-            # impute label inplace to determine ambiguities
-            if impute_label(self.H[:self.i], self.Y[:self.i]):
-                self.put_response(self.Y[self.i - 1])
-            else:
-                break  # an ambiguity was found - let's ask the user
+        if self.batch:
+            ambiguous = self._next_batch()
         else:
+            ambiguous = self._next_sequential()
+
+        if not ambiguous:
             # loop finished - terminate
             self.result = self.order[self.maxi]
             return False
@@ -247,9 +425,69 @@ class HalfspaceMax(_HalfspaceBase):
         self.query = (ret[self.maxi], ret[self.i])
         return True
 
+    def _next_sequential(self):
+        while self.i + 1 < self.n:
+
+            # impute the labels of the planes comparing candidates with best
+            # until the best changes
+            best, others = self.X[self.maxi], self.X[self.i + 1:]
+            planes = (hyperplane(best, other) for other in others)
+            priors = (dominance_labels(best, others) if self.monotone
+                      else None)
+            labels = self.engine.impute_iter(planes, priors)
+            try:
+                for self.i, y in zip(range(self.i + 1, self.n), labels):
+                    if not y:
+                        return True  # an ambiguity was found - ask the user
+                    self._record(y)
+                    if y == -1:
+                        break
+            finally:
+                labels.close()
+        return False
+
+    def _next_batch(self):
+        while self.pending.any():
+            pending = np.flatnonzero(self.pending)
+            best, others = self.X[self.maxi], self.X[pending]
+            labels, decided = self.engine.classify(
+                hyperplanes(best[np.newaxis], others))
+
+            if self.monotone:
+                prior = dominance_labels(best, others)
+                labels[prior != 0] = prior[prior != 0]
+                decided |= prior != 0
+                self.engine.counts["prior"] += int(np.count_nonzero(prior))
+
+            # objects that lose to the max are settled at once
+            beaten = pending[decided & (labels == 1)]
+            self.Y[beaten - 1] = 1
+            self.pending[beaten] = False
+
+            # then take the next object in order, as the sequential mode
+            # would (which may still have to ask about the objects dropped)
+            rest = np.flatnonzero(~(decided & (labels == 1)))
+            if not len(rest):
+                break
+            j = rest[0]
+            self.i = pending[j]
+            if decided[j]:
+                y = labels[j]  # known to beat the max, or ambiguous
+            else:
+                y = self.engine.impute(hyperplane(best, self.X[self.i]))
+            if not y:
+                return True  # ask the user
+            self._record(y)
+        return False
+
     def put_response(self, y):
         """Inform the eliciter of the user's choice."""
+        self.engine.add(hyperplane(self.X[self.maxi], self.X[self.i]), y)
+        self._record(y)
+
+    def _record(self, y):
         self.Y[self.i - 1] = y
+        self.pending[self.i] = False
         if y == -1:
             self.maxi = self.i
         self.query = None  # check next_round is only called after put_response
@@ -290,6 +528,82 @@ def hyperplane(a, b):
     return h
 
 
+def hyperplanes(A, B):
+    """Compute the planes equidistant from the rows of A and B.
+
+    This is the vectorised form of `hyperplane`, returning an array of shape
+    (n, d+1) for rows of shape (n, d) (or broadcastable to it).
+    """
+    mp = (A + B) / 2
+    ab = B - A
+    return np.hstack((ab, (mp * ab).sum(axis=1, keepdims=True)))
+
+
+def _shatter_lp(c, A, bounds):
+    """Solve the shatter test linear program (see ShatterEngine)."""
+    res = linprog(c, A, np.full(len(A), -1.), bounds=bounds, method="highs")
+    return res.x
+
+
+# The process pools are shared by every engine, so they are created on first
+# use (under a lock, as the servers run engines in threads) and last until
+# `shutdown` is called, which happens at exit if not before. Workers are
+# started by a fork server (or spawned where there is none) rather than
+# forked from a process that may be running threads.
+_executors = {}
+_futures = weakref.WeakSet()  # submitted, to cancel those still queued
+_executors_lock = threading.Lock()
+_START_METHOD = ("forkserver" if "forkserver" in
+                 multiprocessing.get_all_start_methods() else "spawn")
+
+
+def _submit(n_jobs, fn, *args):
+    """Run fn in the (shared) process pool with n_jobs workers."""
+    with _executors_lock:
+        if n_jobs not in _executors:
+            _executors[n_jobs] = ProcessPoolExecutor(
+                n_jobs, multiprocessing.get_context(_START_METHOD))
+        future = _executors[n_jobs].submit(fn, *args)
+        _futures.add(future)
+    return future
+
+
+def shutdown():
+    """Stop the process pools of the engines with n_jobs > 1."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        futures = list(_futures)
+        _executors.clear()
+        _futures.clear()
+    # by hand, as shutdown only takes cancel_futures from python 3.9
+    for future in futures:
+        future.cancel()
+    for executor in executors:
+        executor.shutdown()
+
+
+atexit.register(shutdown)
+
+
+def dominance_label(a, b):
+    """Label the query a < b by pareto dominance, where lower is better.
+
+    Returns 1 if a dominates b, -1 if b dominates a, and 0 otherwise.
+    """
+    if (a <= b).all() and (a < b).any():
+        return 1
+    if (b <= a).all() and (b < a).any():
+        return -1
+    return 0
+
+
+def dominance_labels(a, B):
+    """Compute `dominance_label` of a against each row of B."""
+    better = (a <= B).all(axis=1) & (a < B).any(axis=1)
+    worse = (B <= a).all(axis=1) & (B < a).any(axis=1)
+    return better.astype(int) - worse.astype(int)
+
+
 def shatter_test(X, Y):
     r"""Test to see if the points in (X, Y) can be shattered by a hyperplane.
 
@@ -358,26 +672,258 @@ def impute_label(H, Y):
     if len(Y) < 2:
         return False
 
-    # Test if the query could be positive
-    Y[-1] = 1
-    positive = shatter_test(H, Y)
-
-    # Test if the query could be negative
-    Y[-1] = -1
-    negative = shatter_test(H, Y)
-
-    # If positive and negative, then the query is ambiguous
-    imputable = True
-    if positive and negative:
-        imputable = False
-        Y[-1] = 0  # just in case
-    elif positive and not negative:
-        Y[-1] = 1
-    elif negative and not positive:
-        Y[-1] = -1
-    else:
+    engine = ShatterEngine(H.shape[1] - 1, capacity=len(H))
+    for h, y in zip(H[:-1], Y[:-1]):
+        engine.add(h, y)
+
+    Y[-1] = engine.impute(H[-1])
+    return bool(Y[-1] != 0)
+
+
+class ShatterEngine:
+    """Incremental shatter tests for a growing set of labelled hyperplanes.
+
+    This keeps the constraints of the linear program in `shatter_test` for
+    all the labelled hyperplanes in a preallocated buffer, so each test of a
+    new hyperplane only writes one row.
+
+    Tests are answered in layers, cheapest first:
+
+    1. a prior label supplied by the caller (e.g. from pareto dominance),
+    2. sign checks against cached separators ("witnesses") found by earlier
+       feasible tests that are still consistent with the labels,
+    3. the linear program.
+
+    Many hyperplanes can also be classified at once with `classify`.
+
+    The number of tests answered by each layer is kept in `counts`.
+
+    Only labels given by an oracle need to be added: imputed labels are
+    implied by the existing constraints, so they do not change any test.
+
+    Parameters
+    ----------
+    d: int
+        The dimension of the objects, so hyperplanes have shape (d+1,).
+    capacity: int
+        The initial number of rows to allocate (the buffer grows as needed).
+    n_jobs: int
+        The number of processes to solve linear programs with. With more than
+        one, the two tests of each imputation run concurrently, and
+        `impute_iter` speculatively solves ahead.
+    """
+
+    def __init__(self, d, capacity=16, n_jobs=1):
+        self.n_jobs = n_jobs
+        self.n = 0  # number of labelled hyperplanes
+        self.A = np.zeros((capacity, d + 2))  # rows -[y * h, 1]
+        self.A[:, -1] = -1.
+        self.c = np.zeros(d + 2)  # encodes min_{w, s} s
+        self.c[-1] = 1.
+        self.bounds = [(None, None)] * (d + 1) + [(0., None)]  # s >= 0
+        self.witnesses = np.zeros((0, d + 1))  # separators of the labels
+        self.counts = {"prior": 0, "witness": 0, "lp": 0, "batch": 0}
+        self._facets = None  # facets of the cone of labelled planes
+
+    def add(self, h, y):
+        """Add hyperplane h with label y in {-1, 1} to the constraints."""
+        self._reserve(self.n + 1)
+        self.A[self.n, :-1] = -y * h
+        self.n += 1
+
+        # drop the witnesses that do not separate the new label
+        self.witnesses = self.witnesses[y * (self.witnesses @ h) > 0]
+        self._facets = None
+
+    def feasible(self, h, y):
+        """Test if the labelled hyperplanes and (h, y) can be shattered."""
+        return self._finish(self._start(h, y))
+
+    def _start(self, h, y):
+        """Start a shatter test, giving True or the (future) LP solution."""
+        if (y * (self.witnesses @ h) > 0).any():
+            self.counts["witness"] += 1
+            return True
+
+        self.counts["lp"] += 1
+        self._reserve(self.n + 1)
+        self.A[self.n, :-1] = -y * h
+        A = self.A[:self.n + 1]
+        if self.n_jobs > 1:
+            return _submit(self.n_jobs, _shatter_lp, self.c, A.copy(),
+                           self.bounds)
+        return _shatter_lp(self.c, A, self.bounds)
+
+    def _finish(self, test):
+        """Complete a shatter test, caching the separator if one was found."""
+        if test is True:
+            return True
+
+        x = test.result() if isinstance(test, Future) else test
+        shattered = x[-1] < SHATTER_THRESH
+        if shattered:
+            kept = self.witnesses[-(MAX_WITNESSES - 1):]
+            self.witnesses = np.vstack((kept, x[:-1]))
+        return shattered
+
+    def classify(self, H):
+        """Impute the labels of many hyperplanes H at once, where possible.
+
+        By Farkas' lemma, the label of h is implied by the labelled
+        hyperplanes G (rows y * h) exactly when h or -h lies in the cone
+        generated by G. The facets of that cone are the extreme rays of the
+        cone of separators, and are found once (with qhull) for each new
+        oracle label, so each hyperplane then only needs a sign test against
+        them. Hyperplanes close to a facet are left undecided, as are all of
+        them when the cone is degenerate (e.g. with fewer labels than
+        dimensions), except those the witnesses show are ambiguous.
+
+        Parameters
+        ----------
+        H: ndarray
+            An array of shape (m, d+1) hyperplanes.
+
+        Returns
+        -------
+        labels: ndarray
+            An integer array of shape (m,) of the decided labels in {-1, 1},
+            or 0 where the label is ambiguous.
+        decided: ndarray
+            A boolean array of shape (m,), False where a linear program is
+            still needed to impute the label.
+        """
+        labels = np.zeros(len(H), dtype=int)
+        projected = self.witnesses @ H.T
+        decided = (projected > 0).any(axis=0) & (projected < 0).any(axis=0)
+
+        facets = self._cone_facets()
+        if facets is not None:
+            tol = FACET_TOL * np.linalg.norm(H, axis=1)
+            F = facets @ H.T  # h is in the cone if F @ h <= 0
+            inside = (F <= tol).all(axis=0)
+            opposite = (-F <= tol).all(axis=0)
+            outside = (F > tol).any(axis=0) & (-F > tol).any(axis=0)
+            labels[inside] = 1
+            labels[opposite] = -1
+            decided |= inside ^ opposite | outside
+
+        self.counts["batch"] += int(np.count_nonzero(decided))
+        return labels, decided
+
+    def _cone_facets(self):
+        """Find the outward facet normals of the labelled planes' cone."""
+        if self._facets is None and self.n >= len(self.c) - 1:
+            G = -self.A[:self.n, :-1]
+            G /= np.linalg.norm(G, axis=1, keepdims=True)
+            try:
+                hull = ConvexHull(np.vstack((np.zeros(G.shape[1]), G)))
+            except QhullError:
+                return None  # degenerate - cone is not full dimensional
+
+            # the facets of the cone are the facets of the hull at the origin
+            at_origin = (hull.simplices == 0).any(axis=1)
+            self._facets = hull.equations[at_origin, :-1]
+        return self._facets
+
+    def impute(self, h, prior=0):
+        """Impute the label of hyperplane h.
+
+        Parameters
+        ----------
+        h: ndarray
+            The hyperplane of shape (d+1,).
+        prior: int
+            A label in {-1, 1} known without reference to the constraints,
+            or 0 if there is none.
+
+        Returns
+        -------
+        int:
+            The label in {-1, 1}, or 0 if it is ambiguous.
+
+        Raises
+        ------
+        RuntimeError:
+            If the labelled hyperplanes can no longer be shattered.
+        """
+        return self._finish_impute(self._start_impute(h, prior))
+
+    def impute_iter(self, planes, priors=None):
+        """Impute the labels of a sequence of hyperplanes, in order.
+
+        With n_jobs > 1, the linear programs of upcoming hyperplanes are
+        solved speculatively in a process pool while the earlier labels are
+        consumed. Imputed labels never change the constraints, so these
+        results stay valid until a label is added: callers must stop
+        iterating (and close the generator) before they add one.
+
+        Parameters
+        ----------
+        planes: iterable
+            Hyperplanes of shape (d+1,), which are consumed lazily.
+        priors: iterable
+            Prior labels for each hyperplane (see `impute`).
+
+        Yields
+        ------
+        int:
+            The label of each hyperplane in {-1, 1}, or 0 if it is ambiguous.
+        """
+        if priors is None:
+            priors = repeat(0)
+        items = zip(planes, priors)
+        depth = 2 * self.n_jobs if self.n_jobs > 1 else 1
+        started = deque()
+
+        try:
+            while True:
+                for item in islice(items, depth - len(started)):
+                    started.append(self._start_impute(*item))
+                if not started:
+                    return
+                yield self._finish_impute(started.popleft())
+        finally:
+            for tests in started:
+                for test in tests:
+                    if isinstance(test, Future):
+                        test.cancel()
+
+    def _start_impute(self, h, prior):
+        if prior:
+            self.counts["prior"] += 1
+            return (prior,)
+        if self.n == 0:
+            return (0,)
+        return self._start(h, 1), self._start(h, -1)
+
+    def _finish_impute(self, tests):
+        if len(tests) == 1:
+            return tests[0]  # decided without any test
+
+        positive = self._finish(tests[0])
+        negative = self._finish(tests[1])
+
+        if positive and negative:
+            return 0
+        elif positive:
+            return 1
+        elif negative:
+            return -1
         raise RuntimeError("Ranking has become inconsistent!")
-    return imputable
+
+    def __getstate__(self):
+        """Pickle the labelled rows only, leaving out spare capacity."""
+        state = self.__dict__.copy()
+        state["A"] = self.A[:self.n]
+        state["_facets"] = None  # recomputed on demand
+        return state
+
+    def _reserve(self, m):
+        if m > len(self.A):
+            grown = np.zeros((2 * m, self.A.shape[1]))
+            grown[:, -1] = -1.
+            grown[:self.n] = self.A[:self.n]
+            self.A = grown
 
 
 #
@@ -0,0 +1,84 @@
+"""
+Index of candidate scores for box (range constraint) queries.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+
+import numpy as np
+
+
+class BoxIndex:
+    """
+    Per-attribute sorted scores of a set of candidates.
+
+    A box query finds the candidates whose scores are within a [min, max]
+    range for each constrained attribute. Binary search over each sorted
+    attribute gives the size of its range, so a single range is counted
+    without touching the candidates. Otherwise the candidates in the
+    narrowest range are checked against the others in one vectorised step.
+
+    Parameters
+    ----------
+    candidates: CandidateSet
+        The candidates to index (rows of the query results refer to them).
+    """
+
+    def __init__(self, candidates):
+        self.n = len(candidates)
+        self._columns = {a: candidates.column(a) for a in candidates.attribs}
+        self._order = {a: np.argsort(c, kind="stable")
+                       for a, c in self._columns.items()}
+        self._sorted = {a: c[self._order[a]]
+                        for a, c in self._columns.items()}
+
+    def __len__(self):
+        """Count the indexed candidates."""
+        return self.n
+
+    def _bounds(self, constraints):
+        """Find the span of each constraint's range in its sorted column."""
+        spans = {}
+        for attr, (mi, ma) in constraints.items():
+            if attr not in self._sorted:
+                raise KeyError(f"Unknown attribute {attr}")
+            values = self._sorted[attr]
+            lo = np.searchsorted(values, float(mi), side="left")
+            hi = np.searchsorted(values, float(ma), side="right")
+            spans[attr] = (lo, max(lo, hi))
+        return spans
+
+    def query(self, constraints):
+        """
+        Find the candidates within the constraints.
+
+        Parameters
+        ----------
+        constraints: dict
+            Maps attributes to their (min, max) range.
+
+        Returns
+        -------
+        rows: ndarray
+            The indices of the candidates within every range, in increasing
+            order.
+        """
+        if not constraints:
+            return np.arange(len(self))
+        spans = self._bounds(constraints)
+        narrowest = min(spans, key=lambda a: spans[a][1] - spans[a][0])
+        lo, hi = spans[narrowest]
+        rows = self._order[narrowest][lo:hi]
+
+        keep = np.ones(len(rows), dtype=bool)
+        for attr, (mi, ma) in constraints.items():
+            if attr != narrowest:
+                values = self._columns[attr][rows]
+                keep &= (values >= mi) & (values <= ma)
+        return np.sort(rows[keep])
+
+    def count(self, constraints):
+        """Count the candidates within the constraints (see `query`)."""
+        if len(constraints) == 1:
+            (lo, hi), = self._bounds(constraints).values()
+            return int(hi - lo)
+        return len(self.query(constraints))
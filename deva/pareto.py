@@ -5,38 +5,168 @@ Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
 import numpy as np
+from bisect import bisect_left, bisect_right
+
+
+BLOCK_SIZE = 256  # rows compared against the efficient set at a time
+BLOCK_ELEMENTS = 2**22  # cap on the size of the broadcast comparison
+PIVOT_WEIGHTS = np.array([[1, 1, 1], [1, 2, 2], [2, 1, 2], [2, 2, 1],
+                          [1, 4, 4], [4, 1, 4], [4, 4, 1]], dtype=float)
 
 
 def remove_non_pareto(models):
     """Reduces the set of models down to the efficient set."""
-    n = len(models)
-    dominated = np.zeros(n, dtype=bool)
+    names = list(models)
+    attribs = list(models[names[0]])
+    scores = np.array([[models[n][a] for a in attribs] for n in names],
+                      dtype=float)
 
-    names, scores = zip(*models.items())
-    # count = 0
+    efficient = efficient_mask(scores)
+    result = {n: models[n] for n, e in zip(names, efficient) if e}
 
-    for i, m in enumerate(scores):
-        for j, n in enumerate(scores):
+    d = len(names) - len(result)
+    s = "" if d == 1 else "s"
+    print("Deleted {} pareto inefficient model{}.".format(d, s))
 
-            # optional checks to reduce the number of comparisons
-            if dominated[i]:
-                break
+    return result
 
-            if dominated[j] | (i == j):
-                continue
 
-            dominated[i] |= (all(m[a] >= n[a] for a in m)
-                             & any(m[a] > n[a] for a in m))
-            # count += 1
+def efficient_mask(scores):
+    """
+    Find the pareto efficient rows of a score matrix (lower is better).
 
-    # print(f"Comparisons: {count/len(names)**2:.0%}")
-    efficient = models.copy()
-    for name, dom in zip(names, dominated):
-        if dom:
-            del efficient[name]
+    Dispatches to an O(n log n) sweep when there are two or three columns,
+    and to the blocked pairwise check otherwise.
+    """
+    scores = np.asarray(scores, dtype=float)
+    d = scores.shape[1]
+    if d not in _sweeps or len(scores) == 0:
+        return efficient_set(scores)[0]
+
+    # sort lexicographically, and sweep the unique rows only because
+    # repeated rows do not dominate each other
+    order = np.lexsort(scores.T[::-1])
+    ordered = scores[order]
+    first = np.ones(len(ordered), dtype=bool)
+    first[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    group = np.cumsum(first) - 1
+
+    efficient = np.empty(len(scores), dtype=bool)
+    efficient[order] = _sweeps[d](ordered[first])[group]
+    return efficient
 
-    d = sum(dominated)
-    s = "" if d == 1 else "s"
-    print("Deleted {} pareto inefficient model{}.".format(d, s))
 
+def _sweep_2d(scores):
+    """Pareto filter unique rows sorted lexicographically in two columns."""
+    # a row is dominated if any earlier row is no worse in the second column
+    y = scores[:, 1]
+    best = np.minimum.accumulate(y)
+    efficient = np.ones(len(y), dtype=bool)
+    efficient[1:] = y[1:] < best[:-1]
     return efficient
+
+
+def _sweep_3d(scores):
+    """Pareto filter unique rows sorted lexicographically in three columns."""
+    # Minimisers of positively weighted sums are efficient, so first discard
+    # the rows they dominate with a vectorised check.
+    scale = np.ptp(scores, axis=0)
+    scale[scale == 0] = 1.
+    pivots = scores[np.argmin((scores / scale) @ PIVOT_WEIGHTS.T, axis=0)]
+    candidates = np.flatnonzero(~dominates(pivots, scores).any(axis=1))
+
+    # The staircase holds the (y, z) projections of the efficient rows seen so
+    # far, with y increasing and z strictly decreasing. Staircase points that
+    # a new efficient row dominates in (y, z) can be discarded.
+    ys = []
+    zs = []
+    efficient = np.zeros(len(scores), dtype=bool)
+
+    for i, (_, y, z) in zip(candidates, scores[candidates].tolist()):
+        k = bisect_right(ys, y)
+        if k and zs[k - 1] <= z:
+            continue  # dominated
+        efficient[i] = True
+
+        j = bisect_left(ys, y)
+        stop = j
+        while stop < len(ys) and zs[stop] >= z:
+            stop += 1
+        ys[j:stop] = [y]
+        zs[j:stop] = [z]
+
+    return efficient
+
+
+_sweeps = {2: _sweep_2d, 3: _sweep_3d}
+
+
+def efficient_set(scores, block_size=BLOCK_SIZE):
+    """
+    Find the pareto efficient rows of a score matrix.
+
+    Lower scores are better. A row is dominated if another row is no worse
+    in every column and strictly better in at least one.
+
+    The rows are sorted by the sum of their scores (breaking ties
+    lexicographically), so that a row can only be dominated by rows that come
+    before it. Blocks of rows are then compared against the efficient set
+    found so far, and against the earlier rows of their own block.
+
+    Parameters
+    ----------
+    scores: ndarray
+        An array of shape (n, d) of candidate scores.
+    block_size: int
+        The number of rows to compare in each vectorised step.
+
+    Returns
+    -------
+    efficient: ndarray
+        A boolean array of shape (n,) which is True for the efficient rows.
+    counts: ndarray
+        An integer array of shape (n,) counting the efficient rows that
+        dominate each row (zero for the efficient rows).
+    """
+    scores = np.asarray(scores, dtype=float)
+    n, d = scores.shape
+
+    keys = [scores[:, j] for j in range(d - 1, -1, -1)]
+    order = np.lexsort(keys + [scores.sum(axis=1)])
+    ordered = scores[order]
+
+    front = np.empty((0, d))
+    counts = np.zeros(n, dtype=int)
+
+    for start in range(0, n, block_size):
+        block = ordered[start:start + block_size]
+        b = len(block)
+
+        # compare against the efficient set found so far
+        count = np.zeros(b, dtype=int)
+        step = max(1, BLOCK_ELEMENTS // (b * d))
+        for i in range(0, len(front), step):
+            count += dominates(front[i:i + step], block).sum(axis=1)
+
+        # compare against the earlier rows within the block
+        within = dominates(block, block)
+        own = (count == 0) & ~within.any(axis=1)
+        count += within[:, own].sum(axis=1)
+
+        counts[order[start:start + b]] = count
+        front = np.vstack((front, block[own]))
+
+    efficient = counts == 0
+    return efficient, counts
+
+
+def dominates(a, b):
+    """
+    Test which rows of `a` dominate which rows of `b`.
+
+    Returns a boolean array of shape (len(b), len(a)), where element [i, j]
+    is True if a[j] dominates b[i].
+    """
+    a = a[None, :, :]
+    b = b[:, None, :]
+    return (a <= b).all(axis=2) & (a < b).any(axis=2)
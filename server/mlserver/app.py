@@ -2,17 +2,19 @@
 
 import os
 import os.path
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from util import jsonify, random_key
+import elicitation
 
-import redis
 import toml
-from flask import Flask, session, abort, request, send_from_directory
+from flask import Flask, session, abort, request, send_from_directory, g
 
 from deva import elicit, fileio, logger, compareBase
 # from deva import bounds
-from deva.db import RedisDB, DevDB
-
-import pickle
+from deva.db import RedisDB, DevDB, FakeRedis, SESSION_TTL, SessionExpired, \
+    connect
 
 
 # Set up the flask app
@@ -28,25 +30,72 @@ app.config["SECRET_KEY"] = SECRET_KEY
 # Database for production is redis, is a dict for development
 if app.config["ENV"] == "production":
     print("Using production database (redis)")
-    r = redis.Redis(host=app.config["REDIS_SERVER"],
-                    port=app.config["REDIS_PORT"],
-                    db=0,
-                    socket_connect_timeout=2)
-    db = RedisDB(r, session)
+    if app.config.get("REDIS_FAKE"):
+        r = FakeRedis()  # in-process, e.g. for load tests
+    else:
+        r = connect(app.config["REDIS_SERVER"],
+                    app.config["REDIS_PORT"],
+                    max_connections=app.config.get("REDIS_MAX_CONNECTIONS",
+                                                   16),
+                    timeout=app.config.get("REDIS_TIMEOUT", 2.))
+    db = RedisDB(r, session, g, app.config.get("SESSION_TTL", SESSION_TTL))
 else:
     print("Using development database (thread local object)")
     db = DevDB(session)
 
+# Sessions must be shared when several worker processes serve requests
+if int(os.environ.get("DEVA_WORKERS", 1)) > 1 and (
+        isinstance(db, DevDB) or app.config.get("REDIS_FAKE")):
+    raise ValueError("Several workers need sessions in a redis server")
+
+
+@app.after_request
+def flush_session(response):
+    """Write the session state changed by a request back in one go."""
+    db.flush()
+    return response
+
+
+@app.teardown_request
+def discard_session(exc):
+    """Forget the state of a failed request rather than saving it."""
+    db.discard()
+
+
+@app.errorhandler(SessionExpired)
+def session_expired(exc):
+    """Ask the user to start again when the session's data has expired."""
+    print(exc)
+    db.discard()
+    return jsonify({"error": "Session expired"}), 410
+
+
 eliciters_descriptions = {k: v.description()
                           for k, v in elicit.algorithms.items()}
 
-
-def calc_ranges(candidates, spec):
-    """Extract a list of attributes and their ranges."""
-    keys = spec["metrics"].keys()
-    points = [c.attributes for c in candidates]
-    collated = {k: [p[k] for p in points] for k in keys}
-    return points, collated
+# Workers that precompute the eliciter's response to each possible answer
+# while the user is still deciding (0 to disable)
+SPECULATE_WORKERS = app.config.get("SPECULATE_WORKERS", 2)
+SPECULATE_OPTIONS = 2  # only for queries with at most this many options
+speculator = (ThreadPoolExecutor(SPECULATE_WORKERS) if SPECULATE_WORKERS
+              else None)
+_speculate_slots = threading.Semaphore(SPECULATE_WORKERS)  # free workers
+_speculating = {}  # session id -> (token, future) of its latest job
+_speculating_lock = threading.Lock()
+
+# Loaded scenarios, shared between requests
+scenarios = fileio.ScenarioCache(
+    app.config.get("SCENARIO_CACHE_SIZE", 8),
+    app.config.get("SCENARIO_REVALIDATE", fileio.REVALIDATE))
+
+# Load (and compile) the scenarios up front, so that workers forked from a
+# preloaded app share them
+if app.config.get("PRELOAD_SCENARIOS"):
+    for name in fileio.list_scenarios():
+        try:
+            scenarios.load(name)
+        except Exception as e:
+            print(f"Could not preload scenario {name}: {e!r}")
 
 
 @app.route("/")
@@ -84,24 +133,7 @@ def get_scenarios():
 
 def _scenario(name):
     """Get the data for a particular scenario."""
-    data = fileio.load_scenario(name)
-
-    # Massage the metadata
-    models, spec = data
-    metrics = spec["metrics"]
-    for attr in metrics:
-        for key in metrics[attr]:
-            # get rid of my plural adjustments for now
-            if isinstance(metrics[attr][key], str):
-                metrics[attr][key] = metrics[attr][key].format(s="s")
-
-    for m in models:
-        # make html-friendly uuid
-        m.name = m.name.replace(" ", "_")
-
-    result = (models, spec)
-
-    return result
+    return elicitation.prepare_scenario(scenarios.load(name))
 
 
 @app.route("/bounds/set-box/<scenario>", methods=["PUT"])
@@ -126,38 +158,27 @@ def save_bound(scenario):
 @app.route("/scenarios/<scenario>")
 def get_info(scenario):
     """Get all info about a particular scenario."""
+    shape = request.args.get("shape", "rows")
+    if shape not in elicitation.SHAPES:
+        abort(400)
     candidates, spec = _scenario(scenario)
-    points, _ = calc_ranges(candidates, spec)
+    try:
+        selected, count = elicitation.select_candidates(
+            candidates, scenarios.index(scenario), request.args)
+    except ValueError as e:
+        print(e)
+        abort(400)
+    points = elicitation.candidate_payload(selected, shape)
     r = {"metadata": spec, "candidates": points,
-         "algorithms": eliciters_descriptions}
-    return r
+         "algorithms": eliciters_descriptions,
+         "total": len(candidates), "count": count}
+    return jsonify(r, decimals=None)  # the candidates are already rounded
 
 
 def _get_boundary_sample():
     """Get a couple of samples from the boundary eliciter."""
     sampler = db.bounder
-    if sampler.terminated():
-        model_id = random_key(16)
-        path = "models/" + model_id + ".toml"
-        if not os.path.exists("models"):
-            os.mkdir("models")
-        pickle.dump(sampler, open(path, "wb"))
-        res = {"model_ID": path}
-
-    else:
-        # eliciter has not terminated - extract the next choice
-        assert isinstance(sampler.query, elicit.Candidate)
-        assert isinstance(sampler.baseline, elicit.Candidate)
-        res = {
-            "left": {
-                "name": sampler.query.name,
-                "values": sampler.query.attributes,
-            },
-            "right": {
-                "name": "Baseline",
-                "values": sampler.baseline.attributes,
-            },
-        }
+    res = elicitation.boundary_sample(sampler)
 
     # Update database state
     db.bounder = sampler
@@ -244,14 +265,12 @@ def make_new_deployment_session():
         constraints = data["constraints"]
 
         print("Filtering candidates")
-        filtered = []
-        for c in candidates:
-            for attr, (mi, ma) in constraints.items():
-                val = c[attr]
-                if (val < mi) or (val > ma):
-                    break
-            else:
-                filtered.append(c)
+        try:
+            filtered = elicitation.apply_constraints(
+                candidates, scenarios.index(scenario), constraints)
+        except ValueError as e:
+            print(e)
+            abort(400)
         print(f"{len(filtered)} candidates remain!")
     else:
         print("No constraints in payload.")
@@ -269,29 +288,110 @@ def make_new_deployment_session():
     log = logger.Logger(scenario, algo, name, spec["metrics"])
     db.eliciter = eliciter
     db.logger = log
+    # the previous eliciter's precomputed answers must never be used
+    session["start"] = random_key(16)
+    del db.branches
     # send our first sample of candidates
-    res = _get_deployment_choice(eliciter, log)
+    res = elicitation.deployment_choice(eliciter, log)
+    _speculate(eliciter, log)
 
     return jsonify(res)
 
 
-def _get_deployment_choice(eliciter, log):
-
-    if not eliciter.terminated():
-        res = []
+@app.route("/deployment/count", methods=["PUT"])
+def count_candidates():
+    """Count the candidates of a scenario within the constraints."""
+    data = request.get_json(force=True)
+    index = scenarios.index(data["scenario"], validate=False)
+    try:
+        count = elicitation.count_constraints(index,
+                                              data.get("constraints", {}))
+    except ValueError as e:
+        print(e)
+        abort(400)
+    return jsonify({"count": count, "total": len(index)})
+
+
+def _branch_tag(eliciter, log):
+    """Identify the question that precomputed answers respond to."""
+    return (session.get("start"), len(log.choices),
+            tuple(o.name for o in eliciter.query()))
+
+
+def _speculate(eliciter, log):
+    """
+    Start precomputing the eliciter's response to each possible answer.
+
+    The session's earlier precomputation is superseded (cancelled if it has
+    not started yet), and none is started while every worker is busy.
+    """
+    if speculator is None:
+        return
+    ident = session["id"]
+    token = object()
+    with _speculating_lock:
+        previous = _speculating.get(ident)
+        _speculating[ident] = (token, None)
+    if previous is not None and previous[1] is not None:
+        # outside the lock, as cancelling runs _finish
+        previous[1].cancel()
+    if (eliciter.terminated() or len(eliciter.query()) > SPECULATE_OPTIONS
+            or not _speculate_slots.acquire(blocking=False)):
+        _forget(ident, token)
+        return  # if the pool is busy, the next request answers itself
+    job = speculator.submit(_precompute, db.bind(ident), ident, token,
+                            _branch_tag(eliciter, log), eliciter)
+    with _speculating_lock:
+        if _speculating.get(ident, (None,))[0] is token:
+            _speculating[ident] = (token, job)
+    job.add_done_callback(lambda job: _finish(ident, token))
+
+
+def _current(ident, token):
+    """Check that a precomputation has not been superseded."""
+    with _speculating_lock:
+        return _speculating.get(ident, (None,))[0] is token
+
+
+def _finish(ident, token):
+    """Free the slot of a finished (or cancelled) precomputation."""
+    _speculate_slots.release()
+    _forget(ident, token)
+
+
+def _forget(ident, token):
+    """Stop tracking a session's precomputation, unless superseded."""
+    with _speculating_lock:
+        if _speculating.get(ident, (None,))[0] is token:
+            del _speculating[ident]
+
+
+def _precompute(store, ident, token, tag, eliciter):
+    """Store the eliciter state after each answer, to be picked from."""
+    try:
+        # the request only reads the eliciter, so it is copied here
+        eliciter = copy.deepcopy(eliciter)
+        branches = {}
         for option in eliciter.query():
-            res.append({"name": option.name, "values": option.attributes})
-    else:
-        log.result = eliciter.result()
-        log.write()
-        res = {}
-
-    return res
+            if not _current(ident, token):
+                return
+            branch = copy.deepcopy(eliciter)
+            try:
+                branch.put(option.name)
+            except RuntimeError:
+                continue  # left for the request to fall back from
+            branches[option.name] = branch
+        if _current(ident, token):
+            store.branches = (tag, branches)
+            store.flush()
+    except Exception as e:
+        print(f"Precomputing answers failed: {e!r}")
 
 
 @app.route("/deployment/choice", methods=["PUT"])
 def get_choice():
     """Inform the front-end of the current eliciter choices."""
+    db.prefetch("eliciter", "logger", "branches")
     if db.eliciter is None:
         print("Session not initialised!")
         abort(400)  # Not initialised
@@ -309,21 +409,19 @@ def get_choice():
     if not eliciter.terminated():
         choice = [v.name for v in eliciter.query()]
         if (x in choice):  # and (y in choice) and (x != y):
+            # use the precomputed response to this answer, if it is ready
+            branches = db.branches
+            tag = _branch_tag(eliciter, log)
             log.choice(eliciter.query(), data)
-            # There is a risk that ActiveMax will hit an inconsistent state
-            # if so, we need to put the user back in a valid state
-            try:
-                eliciter.put(x)
-            except RuntimeError as e:
-                print(e)
-                print("Fallback to ladder")
-                eliciter = elicit.LadderEliciter(
-                    eliciter.candidates, None
-                )
+            if branches and branches[0] == tag and x in branches[1]:
+                eliciter = branches[1][x]
+            else:
+                eliciter = elicitation.answer(eliciter, x)
 
     # have to check again because now it might be terminated
     # after we added a new choice above
-    res = _get_deployment_choice(eliciter, log)
+    res = elicitation.deployment_choice(eliciter, log)
+    _speculate(eliciter, log)
 
     # Write back to database
     db.eliciter = eliciter
@@ -335,15 +433,5 @@ def get_choice():
 @app.route("/deployment/result")
 def get_result():
     """Get the eliciter result, if it exists."""
-    eliciter = db.eliciter
-    if eliciter.terminated():
-        result = eliciter.result()
-        res = {
-            result.name: {
-                "attr": result.attributes,
-                "spec": result.spec_name
-            }
-        }
-    else:
-        res = {}
+    res = elicitation.deployment_result(db.eliciter)
     return jsonify(res)
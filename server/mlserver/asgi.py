@@ -0,0 +1,335 @@
+"""
+ASGI backend elicitation server for AI Impact Control Panel.
+
+Serves the scenario, deployment and boundary endpoints of the flask server
+(app.py) from an event loop. Session storage and file access run in worker
+threads so they do not block the loop, eliciter steps run in a bounded pool
+of processes, and the requests of each session are handled one at a time so
+that concurrent clicks cannot race on its eliciter.
+
+Run with `uvicorn asgi:app` (see run_asgi.sh).
+"""
+
+import os
+import asyncio
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from flask import Config
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.sessions import SessionMiddleware
+
+from util import DECIMALS, dumps, random_key
+import elicitation
+from deva import elicit, fileio, logger
+from deva.db import RedisDB, DevDB, FakeRedis, SESSION_TTL, SessionExpired, \
+    StorageError, connect
+
+
+# Same configuration files as the flask server
+config = Config(os.path.dirname(os.path.abspath(__file__)))
+config.from_envvar("DEVA_MLSERVER_CONFIG")
+ENV = os.environ.get("DEVA_ENV", "production")
+
+# Secret key for signing session cookies
+SECRET_KEY = os.environ.get("SECRET_KEY")
+if not SECRET_KEY:
+    raise ValueError("No SECRET_KEY set for ASGI application")
+
+app = FastAPI()
+app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY,
+                   max_age=config.get("SESSION_TTL", SESSION_TTL))
+
+# Database for production is redis, is a dict for development. Each request
+# binds its own copy to the session.
+if ENV == "production":
+    print("Using production database (redis)")
+    if config.get("REDIS_FAKE"):
+        r = FakeRedis()  # in-process, e.g. for load tests
+    else:
+        r = connect(config["REDIS_SERVER"], config["REDIS_PORT"],
+                    max_connections=config.get("REDIS_MAX_CONNECTIONS", 16),
+                    timeout=config.get("REDIS_TIMEOUT", 2.))
+    store = RedisDB(r, {}, None, config.get("SESSION_TTL", SESSION_TTL))
+else:
+    print("Using development database (process local object)")
+    store = DevDB({})
+
+eliciters_descriptions = {k: v.description()
+                          for k, v in elicit.algorithms.items()}
+
+# Processes for the eliciter steps, and the most steps submitted at once
+ELICIT_WORKERS = config.get("ELICIT_WORKERS", 2)
+ELICIT_BACKLOG = config.get("ELICIT_BACKLOG", 4 * ELICIT_WORKERS)
+
+# Loaded scenarios, shared between requests
+scenarios = fileio.ScenarioCache(
+    config.get("SCENARIO_CACHE_SIZE", 8),
+    config.get("SCENARIO_REVALIDATE", fileio.REVALIDATE))
+
+_pool = None
+_backlog = None
+_locks = weakref.WeakValueDictionary()  # session id -> asyncio.Lock
+_pending = set()  # eliciter steps submitted, to cancel at shutdown
+
+
+@app.on_event("startup")
+async def start_pool():
+    """Start the processes that run the eliciter steps."""
+    global _pool, _backlog
+    # spawn rather than fork, as the server already runs threads
+    _pool = ProcessPoolExecutor(ELICIT_WORKERS,
+                                multiprocessing.get_context("spawn"))
+    _backlog = asyncio.Semaphore(ELICIT_BACKLOG)
+
+
+@app.on_event("shutdown")
+async def stop_pool():
+    """Stop the eliciter processes."""
+    # by hand, as shutdown only takes cancel_futures from python 3.9
+    for future in list(_pending):
+        future.cancel()
+    _pool.shutdown()
+
+
+@app.exception_handler(StorageError)
+async def storage_unavailable(request, exc):
+    """Report that the session storage could not be reached."""
+    return JSONResponse({"detail": str(exc)}, status_code=503)
+
+
+@app.exception_handler(SessionExpired)
+async def session_expired(request, exc):
+    """Ask the user to start again when the session's data has expired."""
+    print(exc)
+    return JSONResponse({"error": "Session expired"}, status_code=410)
+
+
+async def _elicit(fn, *args):
+    """Run an eliciter step in the process pool, waiting for a free slot."""
+    async with _backlog:
+        future = _pool.submit(fn, *args)
+        _pending.add(future)
+        future.add_done_callback(_pending.discard)
+        return await asyncio.wrap_future(future)
+
+
+def _ident(request, create=False):
+    """Get the session id, making a new session if create is set."""
+    if "id" not in request.session:
+        if not create:
+            print("Session not initialised!")
+            raise HTTPException(400)
+        request.session["id"] = random_key(16)
+    return request.session["id"]
+
+
+def _lock(ident):
+    """Get the lock serialising the requests of a session."""
+    lock = _locks.get(ident)
+    if lock is None:
+        lock = _locks[ident] = asyncio.Lock()
+    return lock
+
+
+async def _scenario(name):
+    """Get the data for a particular scenario."""
+    data = await run_in_threadpool(scenarios.load, name)
+    return elicitation.prepare_scenario(data)
+
+
+def jsonify(o, decimals=DECIMALS):
+    """Make a JSON response with floats rounded (unless decimals is None)."""
+    return Response(dumps(o, decimals), media_type="application/json")
+
+
+@app.get("/")
+async def check_status():
+    """Confirm API status."""
+    res = {"tasks": ["deployment", "boundaries"]}
+    return jsonify(res)
+
+
+@app.get("/scenarios")
+async def get_scenarios():
+    """Get all scenarios in server folder."""
+    data = await run_in_threadpool(fileio.list_scenarios)
+    return jsonify(data)
+
+
+@app.get("/scenarios/{scenario}")
+async def get_info(scenario: str, request: Request, shape: str = "rows"):
+    """Get all info about a particular scenario."""
+    if shape not in elicitation.SHAPES:
+        raise HTTPException(400)
+    candidates, spec = await _scenario(scenario)
+    index = await run_in_threadpool(scenarios.index, scenario)
+    try:
+        selected, count = await run_in_threadpool(
+            elicitation.select_candidates, candidates, index,
+            request.query_params)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    points = elicitation.candidate_payload(selected, shape)
+    r = {"metadata": spec, "candidates": points,
+         "algorithms": eliciters_descriptions,
+         "total": len(candidates), "count": count}
+    return jsonify(r, decimals=None)  # the candidates are already rounded
+
+
+@app.put("/boundaries/new")
+async def init_bounds(request: Request):
+    """Initialise a bounds elicitation session."""
+    _ident(request, create=True)
+    # Boundary elicitation not currently exposed (see app.py).
+    return jsonify({})
+
+
+@app.put("/boundaries/choice")
+async def get_bounds_choice(request: Request):
+    """Accept the user's choice for a bounds elicitation session."""
+    ident = _ident(request)
+    data = await request.json()
+    async with _lock(ident):
+        db = store.bind(ident)
+        await run_in_threadpool(db.prefetch, "bounder")
+        sampler = db.bounder
+        if sampler is None:
+            print("Session not initialised!")
+            raise HTTPException(400)  # Not initialised
+
+        x = data["first"]
+        y = data["second"]
+        options = [sampler.query.name, "Baseline"]
+        valid = (x in options) & (y in options)
+
+        # Only pass valid choices on to the eliciter
+        if (not sampler.terminated() and valid):
+            sampler = await _elicit(elicitation.answer_bounds, sampler,
+                                    x == sampler.query.name)
+        else:
+            print("Ignoring input")
+
+        # now send a new choice
+        res = await run_in_threadpool(elicitation.boundary_sample, sampler)
+        db.bounder = sampler
+        await run_in_threadpool(db.flush)
+
+    return jsonify(res)
+
+
+@app.put("/deployment/new")
+async def make_new_deployment_session(request: Request):
+    """Initialise an eliciter with a particular algorithm and scenario."""
+    ident = _ident(request, create=True)
+
+    # get info about setup from the frontend
+    data = await request.json()
+    scenario = data["scenario"]
+    algo = data["algorithm"]
+    name = data["name"]
+
+    candidates, spec = await _scenario(scenario)
+
+    if "constraints" in data:
+        index = await run_in_threadpool(scenarios.index, scenario)
+        try:
+            filtered = elicitation.apply_constraints(candidates, index,
+                                                     data["constraints"])
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        print(f"{len(filtered)} candidates remain!")
+    else:
+        filtered = candidates
+    if len(filtered) == 0:
+        print("No candidates - how?")
+        return jsonify({})
+    elif len(filtered) == 1:
+        print("One candidate remains - no eliciter required.")
+        algo = "Ladder"  # pick an eliciter that supports one candidate
+
+    async with _lock(ident):
+        # assume that a reload means user wants a restart
+        eliciter = await _elicit(elicit.algorithms[algo], filtered, spec)
+        log = logger.Logger(scenario, algo, name, spec["metrics"])
+        res = await run_in_threadpool(elicitation.deployment_choice,
+                                      eliciter, log)
+
+        db = store.bind(ident)
+        db.eliciter = eliciter
+        db.logger = log
+        await run_in_threadpool(db.flush)
+
+    return jsonify(res)
+
+
+@app.put("/deployment/count")
+async def count_candidates(request: Request):
+    """Count the candidates of a scenario within the constraints."""
+    data = await request.json()
+    index = await run_in_threadpool(scenarios.index, data["scenario"],
+                                    validate=False)
+    try:
+        count = elicitation.count_constraints(index,
+                                              data.get("constraints", {}))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return jsonify({"count": count, "total": len(index)})
+
+
+@app.put("/deployment/choice")
+async def get_choice(request: Request):
+    """Inform the front-end of the current eliciter choices."""
+    ident = _ident(request)
+    data = await request.json()
+    x = data["first"]
+
+    async with _lock(ident):
+        db = store.bind(ident)
+        await run_in_threadpool(db.prefetch, "eliciter", "logger")
+        eliciter = db.eliciter
+        log = db.logger
+        if eliciter is None:
+            print("Session not initialised!")
+            raise HTTPException(400)  # Not initialised
+
+        # Only pass valid choices on to the eliciter
+        if not eliciter.terminated():
+            if x in [v.name for v in eliciter.query()]:
+                log.choice(eliciter.query(), data)
+                eliciter = await _elicit(elicitation.answer, eliciter, x)
+
+        # have to check again because now it might be terminated
+        # after we added a new choice above
+        res = await run_in_threadpool(elicitation.deployment_choice,
+                                      eliciter, log)
+
+        # Write back to database
+        db.eliciter = eliciter
+        db.logger = log
+        await run_in_threadpool(db.flush)
+
+    return jsonify(res)
+
+
+@app.get("/deployment/result")
+async def get_result(request: Request):
+    """Get the eliciter result, if it exists."""
+    db = store.bind(_ident(request))
+    await run_in_threadpool(db.prefetch, "eliciter")
+    if db.eliciter is None:
+        raise HTTPException(400)  # Not initialised
+    return jsonify(elicitation.deployment_result(db.eliciter))
+
+
+@app.get("/deployment/logs/{ftype}")
+async def send_log(ftype: str, request: Request):
+    """Send a completed session logfile to the user."""
+    db = store.bind(_ident(request))
+    await run_in_threadpool(db.prefetch, "logger")
+    if db.logger is None or ftype not in db.logger.files:
+        raise HTTPException(404)  # incorrect usage
+    return FileResponse(db.logger.files[ftype])
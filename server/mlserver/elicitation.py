@@ -0,0 +1,209 @@
+"""Elicitation steps shared by the flask and ASGI servers."""
+
+import os
+import json
+import pickle
+
+import numpy as np
+
+from util import random_key, round_array
+from deva import cluster, elicit
+
+
+def prepare_scenario(data):
+    """Massage a loaded scenario's data for the frontend."""
+    models, spec = data
+    metrics = spec["metrics"]
+    for attr in metrics:
+        for key in metrics[attr]:
+            # get rid of my plural adjustments for now
+            if isinstance(metrics[attr][key], str):
+                metrics[attr][key] = metrics[attr][key].format(s="s")
+
+    # make html-friendly uuid
+    models.names = [n.replace(" ", "_") for n in models.names]
+
+    return models, spec
+
+
+SHAPES = ("rows", "columns")  # of the candidates in scenario info
+SAMPLERS = {  # downsampling of scenario info -> size parameter, default
+    "grid": ("bins", 10),
+    "representative": ("size", 100),
+}
+
+
+def candidate_payload(candidates, shape="rows"):
+    """
+    Tabulate the candidates' attributes, rounded, for a response.
+
+    The "rows" shape is a list of each candidate's attributes, and the
+    "columns" shape maps each attribute to an array of its values, which is
+    far smaller and faster to encode.
+    """
+    table = elicit.CandidateSet.from_candidates(candidates)
+    scores = round_array(table.scores)
+    if shape == "columns":
+        return dict(zip(table.attribs, np.ascontiguousarray(scores.T)))
+    return [dict(zip(table.attribs, row)) for row in scores.tolist()]
+
+
+def apply_constraints(candidates, index, constraints):
+    """
+    Keep the candidates within the (min, max) range of each attribute.
+
+    The index is the scenario's BoxIndex, whose rows are the candidates.
+    Raises ValueError if the constraints are not valid.
+    """
+    return candidates[_box(index.query, constraints)]
+
+
+def count_constraints(index, constraints):
+    """Count the candidates that `apply_constraints` would keep."""
+    return _box(index.count, constraints)
+
+
+def _box(query, constraints):
+    """Run a box query, raising ValueError for invalid constraints."""
+    try:
+        return query(constraints)
+    except (TypeError, KeyError, AttributeError, ValueError) as e:
+        raise ValueError(f"Invalid constraints: {e!r}") from e
+
+
+def select_candidates(candidates, index, query):
+    """
+    Select the candidates to send for the scenario info query parameters.
+
+    The candidates within the constraints are downsampled if requested, and
+    then paginated.
+
+    Parameters
+    ----------
+    candidates: CandidateSet
+        All of the scenario's candidates.
+    index: BoxIndex
+        The index of the candidates.
+    query: Mapping
+        The query parameters, all optional:
+        constraints: JSON object of attribute -> [min, max]
+        sample: "grid" keeps a candidate from each cell of a grid with
+            `bins` (default 10) cells along each attribute, "representative"
+            keeps `size` (default 100) candidates spread across the front
+        offset, limit: the page of the remaining candidates to send
+
+    Returns
+    -------
+    selected: CandidateSet
+        The page of candidates, in scenario order.
+    count: int
+        The number of candidates before pagination.
+
+    Raises
+    ------
+    ValueError
+        If the query parameters are not valid.
+    """
+    if "constraints" in query:
+        constraints = json.loads(query["constraints"])
+        candidates = apply_constraints(candidates, index, constraints)
+
+    sample = query.get("sample")
+    if sample is not None and len(candidates):
+        if sample not in SAMPLERS:
+            raise ValueError(f"Unknown sampler {sample}")
+        size = _integer(query, *SAMPLERS[sample], least=1)
+        X = candidates.scores
+        if sample == "grid":
+            rows = cluster.grid(X, size)
+        else:
+            rows = np.sort(cluster.spread(X, min(size, len(X))))
+        candidates = candidates[rows]
+
+    offset = _integer(query, "offset", 0)
+    limit = _integer(query, "limit", len(candidates))
+    return candidates[offset:offset + limit], len(candidates)
+
+
+def _integer(query, name, default, least=0):
+    """Get an integer query parameter, of at least `least`."""
+    value = int(query.get(name, default))
+    if value < least:
+        raise ValueError(f"{name} must be at least {least}")
+    return value
+
+
+def boundary_sample(sampler):
+    """Get a couple of samples from the boundary eliciter."""
+    if sampler.terminated():
+        model_id = random_key(16)
+        path = "models/" + model_id + ".toml"
+        if not os.path.exists("models"):
+            os.mkdir("models")
+        pickle.dump(sampler, open(path, "wb"))
+        res = {"model_ID": path}
+
+    else:
+        # eliciter has not terminated - extract the next choice
+        assert isinstance(sampler.query, elicit.Candidate)
+        assert isinstance(sampler.baseline, elicit.Candidate)
+        res = {
+            "left": {
+                "name": sampler.query.name,
+                "values": sampler.query.attributes,
+            },
+            "right": {
+                "name": "Baseline",
+                "values": sampler.baseline.attributes,
+            },
+        }
+
+    return res
+
+
+def answer(eliciter, choice):
+    """Pass a valid choice to the eliciter and return the eliciter."""
+    # There is a risk that ActiveMax will hit an inconsistent state
+    # if so, we need to put the user back in a valid state
+    try:
+        eliciter.put(choice)
+    except RuntimeError as e:
+        print(e)
+        print("Fallback to ladder")
+        eliciter = elicit.LadderEliciter(eliciter.candidates, None)
+    return eliciter
+
+
+def answer_bounds(sampler, choice):
+    """Pass a choice to the boundary sampler and return the sampler."""
+    sampler.put(choice)
+    return sampler
+
+
+def deployment_choice(eliciter, log):
+    """Get the next options to show, writing the log once terminated."""
+    if not eliciter.terminated():
+        res = []
+        for option in eliciter.query():
+            res.append({"name": option.name, "values": option.attributes})
+    else:
+        log.result = eliciter.result()
+        log.write()
+        res = {}
+
+    return res
+
+
+def deployment_result(eliciter):
+    """Describe the eliciter's result, if it has terminated."""
+    if eliciter.terminated():
+        result = eliciter.result()
+        res = {
+            result.name: {
+                "attr": result.attributes,
+                "spec": result.spec_name
+            }
+        }
+    else:
+        res = {}
+    return res
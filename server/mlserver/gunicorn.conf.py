@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for serving the elicitation server with several workers.
+
+Sessions are kept in redis, so any worker can serve any request, and the
+compiled scenario scores are memory mapped, so workers share one copy.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+
+import os
+import multiprocessing
+
+
+bind = os.environ.get("DEVA_BIND", "0.0.0.0:80")
+workers = int(os.environ.get("DEVA_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("DEVA_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.environ.get("DEVA_TIMEOUT", 60))
+
+# import the app once before forking, so workers share its memory
+preload_app = True
+
+# let the app check its session storage is shared between workers
+os.environ["DEVA_WORKERS"] = str(workers)
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+if [ ! -f "server.secret" ]; then
+    echo "server.secret does not exist. Run gen_key.sh"
+    exit 1
+fi
+
+export DEVA_MLSERVER_CONFIG=./prod.cfg
+export SECRET_KEY="$(cat server.secret)"
+DEVA_ENV=production uvicorn asgi:app --host 0.0.0.0 --port 80
@@ -7,4 +7,4 @@ fi
 
 export DEVA_MLSERVER_CONFIG=./prod.cfg
 export SECRET_KEY="$(cat server.secret)"
-FLASK_ENV=production gunicorn -b 0.0.0.0:80 app:app
+FLASK_ENV=production gunicorn -c gunicorn.conf.py app:app
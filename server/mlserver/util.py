@@ -1,24 +1,101 @@
 """Module supporting DEVA flask server."""
-from flask import jsonify as _jsonify
+from flask import Response
+import json
+import math
 import random
 import string
 import numpy as np
 
+try:
+    import orjson
+except ImportError:  # optional, for faster responses
+    orjson = None
+else:
+    _ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+                       | orjson.OPT_NON_STR_KEYS)
 
-def round_floats(o):
-    """Recursively round floats pre-json."""
+
+DECIMALS = 3  # decimal places of the floats in responses
+
+
+def round_floats(o, decimals=DECIMALS):
+    """
+    Recursively round floats pre-json.
+
+    Float arrays are rounded in one vectorised step and kept as arrays, for
+    `dumps` to serialise.
+    """
+    if isinstance(o, float):
+        return round(o, decimals)
+    elif isinstance(o, np.ndarray):
+        return round_array(o, decimals)
+    elif isinstance(o, np.generic):
+        return round_floats(o.item(), decimals)
+    elif isinstance(o, dict):
+        return {k: round_floats(v, decimals) for k, v in o.items()}
+    elif isinstance(o, (list, tuple)):
+        return [round_floats(x, decimals) for x in o]
+    return o
+
+
+def round_array(a, decimals=DECIMALS):
+    """Round the values of a float array (other arrays are unchanged)."""
+    if a.dtype.kind == "f":
+        # as doubles, so that either JSON backend writes the rounded values
+        return np.round(a.astype(float, copy=False), decimals)
+    return a
+
+
+def dumps(o, decimals=None):
+    """
+    Serialise to JSON bytes, with orjson if it is installed.
+
+    Floats are rounded to `decimals` places first, if it is given. Either way
+    the output is the same (with null for NaN and infinite floats), apart
+    from the exponent of floats from 1e16 up (1e16 rather than 1e+16 with
+    orjson).
+    """
+    if decimals is not None:
+        o = round_floats(o, decimals)
+    # keys are sorted, as flask's encoder does
+    if orjson is not None:
+        return orjson.dumps(o, default=_default, option=_ORJSON_OPTIONS)
+    try:
+        return _json_dumps(o)
+    except ValueError:  # NaN or infinity, which orjson writes as null
+        return _json_dumps(_finite(o))
+
+
+def _json_dumps(o):
+    """Serialise to JSON bytes with the json module."""
+    return json.dumps(o, default=_default, sort_keys=True,
+                      separators=(",", ":"), allow_nan=False).encode()
+
+
+def _default(o):
+    """Convert the numpy values that the JSON backend does not support."""
+    if isinstance(o, (np.ndarray, np.generic)):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON "
+                    "serializable")
+
+
+def _finite(o):
+    """Recursively replace the non-finite floats with None."""
     if isinstance(o, float):
-        return round(o, 3)
+        return o if math.isfinite(o) else None
+    elif isinstance(o, (np.ndarray, np.generic)):
+        return _finite(o.tolist())
     elif isinstance(o, dict):
-        return {k: round_floats(v) for k, v in o.items()}
-    elif isinstance(o, (list, tuple, np.ndarray)):
-        return [round_floats(x) for x in o]
+        return {k: _finite(v) for k, v in o.items()}
+    elif isinstance(o, (list, tuple)):
+        return [_finite(x) for x in o]
     return o
 
 
-def jsonify(o):
-    """Apply flask's jsonify with some float formatting."""
-    return _jsonify(round_floats(o))
+def jsonify(o, decimals=DECIMALS):
+    """Make a JSON response with floats rounded (unless decimals is None)."""
+    return Response(dumps(o, decimals), mimetype="application/json")
 
 
 def random_key(n, exclude=()):
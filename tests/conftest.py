@@ -4,10 +4,20 @@ Pytest fixtures and utilities.
 Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 
+import os
+import sys
+import shutil
+import importlib
 import numpy as np
 import pytest
+from deva import fileio, logger
 
 
+# The server modules import each other as top level modules
+SERVER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "server",
+                      "mlserver")
+sys.path.insert(0, SERVER)
+
 SEED = 666
 RAND = np.random.RandomState(SEED)
 
@@ -27,3 +37,31 @@ def shatterable_data():
     Y = np.ones(20, dtype=int)
     Y[10:] *= -1
     return X, Y
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """Copy the jobs scenario to a temporary repository root."""
+    source = os.path.join(fileio.repo_root(), "scenarios", "jobs")
+    shutil.copytree(source, tmp_path / "scenarios" / "jobs",
+                    ignore=shutil.ignore_patterns(fileio.CACHE_DIR, "logs"))
+    monkeypatch.setattr(fileio, "repo_root", lambda: str(tmp_path))
+    monkeypatch.setattr(logger, "repo_root", lambda: str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def import_server(tmp_path_factory):
+    """Get a function to import a server module, with a test configuration."""
+    config = tmp_path_factory.mktemp("config") / "test.cfg"
+    config.write_text("REDIS_FAKE = True\nSPECULATE_WORKERS = 2\n"
+                      "ELICIT_WORKERS = 1\n")
+
+    def load(name):
+        with pytest.MonkeyPatch.context() as m:
+            m.setenv("DEVA_MLSERVER_CONFIG", str(config))
+            m.setenv("SECRET_KEY", "test")
+            m.setenv("DEVA_ENV", "production")
+            return importlib.import_module(name)
+
+    return load
@@ -0,0 +1,168 @@
+"""
+Test the flask server's precomputation of answers.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+import elicitation
+
+TIMEOUT = 10.  # seconds to wait for the precomputations
+
+
+@pytest.fixture(scope="module")
+def server(import_server):
+    """Import the flask app, with sessions in a fake redis."""
+    return import_server("app")
+
+
+@pytest.fixture
+def client(server, repo):
+    """Make a test client of the app, serving the copied scenario."""
+    server.scenarios.clear()
+    yield server.app.test_client()
+    _settle(server)
+
+
+def _settle(server):
+    """Wait for the precomputations in flight to finish."""
+    start = time.time()
+    while server._speculating and time.time() - start < TIMEOUT:
+        time.sleep(0.01)
+    assert not server._speculating
+
+
+def _new(client, **data):
+    """Start eliciting over the jobs scenario."""
+    data = {"scenario": "jobs", "algorithm": "ActiveMax", "name": "test",
+            **data}
+    return client.put("/deployment/new", json=data)
+
+
+def _ident(client):
+    """Get the client's session id."""
+    with client.session_transaction() as session:
+        return session["id"]
+
+
+def _branches(server, client):
+    """Get the client session's precomputed answers."""
+    return server.db.bind(_ident(client)).branches
+
+
+def _count_answers(monkeypatch):
+    """Count the answers the requests compute themselves."""
+    answers = []
+    original = elicitation.answer
+
+    def answer(eliciter, choice):
+        answers.append(choice)
+        return original(eliciter, choice)
+
+    monkeypatch.setattr(elicitation, "answer", answer)
+    return answers
+
+
+def test_precomputed(server, client, monkeypatch):
+    """Test answers are taken from the precomputed branches."""
+    answers = _count_answers(monkeypatch)
+    query = _new(client).json
+    _settle(server)
+    tag, branches = _branches(server, client)
+    assert tag[1:] == (0, tuple(o["name"] for o in query))
+    assert set(branches) == {o["name"] for o in query}
+
+    res = client.put("/deployment/choice", json={"first": query[0]["name"]})
+    assert res.status_code == 200
+    assert not answers
+
+
+def test_busy(server, client, monkeypatch):
+    """Test nothing is precomputed while every worker is busy."""
+    monkeypatch.setattr(server, "_speculate_slots", threading.Semaphore(0))
+    answers = _count_answers(monkeypatch)
+    query = _new(client).json
+    assert not server._speculating
+    assert _branches(server, client) is None
+
+    client.put("/deployment/choice", json={"first": query[0]["name"]})
+    assert answers == [query[0]["name"]]
+
+
+def test_new_session(server, client, monkeypatch):
+    """Test a new session never uses the previous eliciter's answers."""
+    query = _new(client).json
+    _settle(server)
+    assert _branches(server, client) is not None
+
+    # the new session asks the same first question, with the pool busy
+    monkeypatch.setattr(server, "_speculate_slots", threading.Semaphore(0))
+    answers = _count_answers(monkeypatch)
+    assert _new(client).json == query
+    assert _branches(server, client) is None
+    client.put("/deployment/choice", json={"first": query[0]["name"]})
+    assert answers == [query[0]["name"]]
+
+
+def test_stale_tag(server, client, monkeypatch):
+    """Test branches tagged for another session or question are ignored."""
+    _new(client)
+    _settle(server)
+    store = server.db.bind(_ident(client))
+    (start, n, names), branches = store.branches
+    monkeypatch.setattr(server, "_speculate_slots", threading.Semaphore(0))
+    answers = _count_answers(monkeypatch)
+
+    for stale in [(start, n, names), (None, n, names), ("a", n + 1, names)]:
+        _new(client)
+        with client.session_transaction() as session:
+            assert session["start"] != start
+        if stale[0] == "a":
+            stale = (session["start"],) + stale[1:]
+        store.branches = (stale, branches)
+        store.flush()
+        client.put("/deployment/choice", json={"first": names[0]})
+        assert answers == [names[0]]
+        answers.clear()
+
+
+def test_cancel(server, client, monkeypatch):
+    """Test a pending precomputation is cancelled when it is superseded."""
+    _new(client)
+    _settle(server)
+    ident = _ident(client)
+    store = server.db.bind(ident)
+    eliciter, log = store.eliciter, store.logger
+
+    # one worker, which is kept busy
+    speculator = ThreadPoolExecutor(1)
+    monkeypatch.setattr(server, "speculator", speculator)
+    monkeypatch.setattr(server, "_speculate_slots", threading.Semaphore(2))
+    release = threading.Event()
+    speculator.submit(release.wait, TIMEOUT)
+
+    def speculate():
+        with server.app.test_request_context():
+            server.session["id"] = ident
+            server._speculate(eliciter, log)
+
+    try:
+        speculate()
+        token, pending = server._speculating[ident]
+        assert not pending.running()
+
+        # superseding cancels (and so finishes) the pending job
+        thread = threading.Thread(target=speculate, daemon=True)
+        thread.start()
+        thread.join(TIMEOUT)
+        assert not thread.is_alive()
+        assert pending.cancelled()
+        assert server._speculating[ident][0] is not token
+    finally:
+        release.set()
+        _settle(server)
+        speculator.shutdown()
+    assert server._speculate_slots._value == 2
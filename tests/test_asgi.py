@@ -0,0 +1,155 @@
+"""
+Test the ASGI server's endpoints, against those of the flask server.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import json
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from deva import db
+
+
+@pytest.fixture(scope="module")
+def server(import_server):
+    """Import the ASGI app, with sessions in a fake redis."""
+    return import_server("asgi")
+
+
+@pytest.fixture(scope="module")
+def flask_server(import_server):
+    """Import the flask app to compare with."""
+    return import_server("app")
+
+
+@pytest.fixture
+def client(server, flask_server, repo):
+    """Make a test client of the app (running its startup and shutdown)."""
+    server.scenarios.clear()
+    flask_server.scenarios.clear()
+    with TestClient(server.app) as client:
+        yield client
+
+
+def _new(client, **data):
+    """Start eliciting over the jobs scenario."""
+    data = {"scenario": "jobs", "algorithm": "ActiveMax", "name": "test",
+            **data}
+    return client.put("/deployment/new", json=data)
+
+
+CONSTRAINTS = {"fnr": [40, 80], "precision": [-70, -40]}
+
+
+@pytest.mark.parametrize("query", [
+    {},
+    {"shape": "columns"},
+    {"constraints": json.dumps(CONSTRAINTS), "offset": 2, "limit": 5},
+    {"sample": "grid", "bins": 3},
+])
+def test_scenario(client, flask_server, query):
+    """Test the scenario info matches the flask server's."""
+    res = client.get("/scenarios/jobs", params=query)
+    assert res.status_code == 200
+    expected = flask_server.app.test_client().get("/scenarios/jobs",
+                                                  query_string=query)
+    assert res.json() == expected.json
+
+
+@pytest.mark.parametrize("query", [
+    {"shape": "diagonal"},
+    {"constraints": "{"},
+    {"offset": -1},
+    {"sample": "everything"},
+])
+def test_scenario_invalid(client, query):
+    """Test invalid scenario info queries are rejected."""
+    assert client.get("/scenarios/jobs", params=query).status_code == 400
+
+
+def test_count(client, flask_server):
+    """Test counting candidates matches the flask server."""
+    flask_client = flask_server.app.test_client()
+    for constraints in [{}, CONSTRAINTS]:
+        data = {"scenario": "jobs", "constraints": constraints}
+        res = client.put("/deployment/count", json=data)
+        assert res.status_code == 200
+        assert res.json() == flask_client.put("/deployment/count",
+                                              json=data).json
+    assert res.json()["count"] < res.json()["total"]
+
+    data = {"scenario": "jobs", "constraints": {"unknown": [0, 1]}}
+    assert client.put("/deployment/count", json=data).status_code == 400
+
+
+def test_new(client, flask_server):
+    """Test a new session asks the same first question as the flask one."""
+    res = _new(client)
+    assert res.status_code == 200
+    assert len(res.json()) == 2
+    assert res.json() == _new(flask_server.app.test_client()).json
+
+    res = _new(client, constraints=CONSTRAINTS)
+    assert res.status_code == 200
+    assert _new(client, constraints={"fnr": 5}).status_code == 400
+
+
+def test_choice(client):
+    """Test answering questions through to a result."""
+    assert client.put("/deployment/choice",
+                      json={"first": "System_A"}).status_code == 400
+    query = _new(client).json()
+    assert client.get("/deployment/result").json() == {}
+
+    # invalid answers are ignored
+    res = client.put("/deployment/choice", json={"first": "nobody"})
+    assert res.json() == query
+
+    while query:
+        res = client.put("/deployment/choice",
+                         json={"first": query[0]["name"]})
+        assert res.status_code == 200
+        query = res.json()
+    result = client.get("/deployment/result").json()
+    assert len(result) == 1
+
+
+def test_session_lock(client, server, monkeypatch):
+    """Test the concurrent requests of a session run one at a time."""
+    query = _new(client).json()
+    steps = []
+    active = 0
+
+    async def elicit(fn, *args):
+        nonlocal active
+        active += 1
+        steps.append(active)
+        await asyncio.sleep(0.05)  # for the other requests to catch up
+        active -= 1
+        return fn(*args)
+
+    monkeypatch.setattr(server, "_elicit", elicit)
+    threads = [threading.Thread(target=client.put,
+                                args=("/deployment/choice",),
+                                kwargs={"json": {"first": query[0]["name"]}})
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert steps and max(steps) == 1
+
+
+def test_expired(client, server, monkeypatch):
+    """Test a session whose scenario data has expired is told so."""
+    monkeypatch.setattr(db, "BLOB_MIN", 64)
+    db._written.clear()
+    query = _new(client).json()
+    for key in list(server.r.scan_iter("blob/*")):
+        server.r.delete(key)
+    db._blobs.clear()
+
+    res = client.put("/deployment/choice", json={"first": query[0]["name"]})
+    assert res.status_code == 410
+    assert res.json() == {"error": "Session expired"}
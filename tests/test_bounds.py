@@ -0,0 +1,65 @@
+"""
+Test the bounds eliciters.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import numpy as np
+from deva import bounds
+
+
+class PositiveActive(bounds.LinearActive):
+    """Only allow queries with positive metrics."""
+
+    def valid_mask(self, Q):
+        """Check every metric is positive."""
+        return (Q > 0).all(axis=1)
+
+
+def make_eliciter(cls=bounds.LinearActive, **kwargs):
+    """Make a linear active eliciter around a reference point."""
+    table = np.random.RandomState(0).rand(50, 3)
+    ref = table.mean(axis=0)
+    return cls(ref, table, ["a", "b", "c"], steps=10, epsilon=0.,
+               n_steps_converge=3, **kwargs)
+
+
+def test_reproducible():
+    """Test seeded eliciters ask the same questions."""
+    a = make_eliciter(random_state=1)
+    b = make_eliciter(random_state=1)
+    for _ in range(3):
+        assert np.all(a.choice == b.choice)
+        a.put(1)
+        b.put(1)
+
+
+def test_sample_valid():
+    """Test invalid random queries are redrawn."""
+    eliciter = make_eliciter(PositiveActive, random_state=0)
+
+    Q = eliciter.sample(lambda n: eliciter.rng.standard_normal((n, 3)), 500)
+    assert Q.shape == (500, 3)
+    assert (Q > 0).all()
+    assert eliciter.check_valid(eliciter.choice)
+
+
+def test_training_data():
+    """Test labelled queries are kept in growing arrays."""
+    data = bounds.TrainingData([[0., 1.], [1., 0.]], [0, 1], capacity=2)
+    for i in range(5):
+        data.append([i, i], i % 2)
+
+    assert data.X.shape == (7, 2)
+    assert np.all(data.X[2:, 0] == np.arange(5))
+    assert np.all(data.y == [0, 1, 0, 1, 0, 1, 0])
+
+
+def test_plane_queries():
+    """Test plane queries lie on the decision boundary."""
+    eliciter = make_eliciter(random_state=0, query_mode="plane")
+    w = np.array([1., -2., 0.5])
+
+    for _ in range(5):
+        margin = eliciter.lr.decision_function([eliciter.choice])
+        assert np.allclose(margin, 0.)
+        eliciter.put(int((eliciter.choice - eliciter.ref) @ w < 0))
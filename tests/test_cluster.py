@@ -0,0 +1,59 @@
+"""
+Test the clustering engines.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import numpy as np
+import pytest
+from deva import cluster
+
+
+@pytest.mark.parametrize("engine", cluster.engines)
+def test_engines(random, engine):
+    """Test each engine finds k reproducible centres."""
+    X = random.rand(500, 3)
+    fit = cluster.engines[engine]
+
+    centres = fit(X, 4)
+    assert centres.shape == (4, 3)
+    assert np.allclose(centres, fit(X, 4))
+
+    warm = fit(X, 4, centres)
+    assert warm.shape == (4, 3)
+
+
+def test_farthest(random):
+    """Test farthest point sampling picks distinct rows of X."""
+    X = random.rand(100, 2)
+    centres = cluster.farthest(X, 5)
+    rows = cluster.nearest(X, centres)
+    assert len(set(rows)) == 5
+    assert np.all(X[rows] == centres)
+
+
+def test_nearest(random):
+    """Test the vectorised nearest row matches a direct search."""
+    X = random.rand(200, 3)
+    centres = random.rand(6, 3)
+    expected = [np.argmin(np.linalg.norm(X - c, axis=1)) for c in centres]
+    assert np.all(cluster.nearest(X, centres) == expected)
+
+
+def test_spread(random):
+    """Test spread picks distinct rows, starting nearest the mean."""
+    X = random.rand(100, 3)
+    rows = cluster.spread(X, 10)
+    assert len(set(rows)) == 10
+    assert np.all(X[rows] == cluster.farthest(X, 10))
+
+
+def test_grid(random):
+    """Test grid sampling keeps the first row in each occupied cell."""
+    X = random.rand(1000, 2)
+    rows = cluster.grid(X, 4)
+    assert len(rows) == 16  # every cell is occupied
+    assert np.all(np.diff(rows) > 0)
+
+    cells = {tuple(c) for c in np.minimum((X * 4).astype(int), 3)[rows]}
+    assert len(cells) == 16
+    assert np.all(cluster.grid(X, 1) == [0])
@@ -0,0 +1,225 @@
+"""
+Test the session storage.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import pickle
+import time
+import types
+import numpy as np
+import pytest
+import redis
+from deva import db, elicit
+
+
+class CountingRedis(db.FakeRedis):
+    """A fake redis client that counts round trips."""
+
+    def __init__(self):
+        super().__init__()
+        self.trips = 0
+
+    def get(self, key):
+        """Get a value."""
+        self.trips += 1
+        return super().get(key)
+
+    def mget(self, keys):
+        """Get many values."""
+        self.trips += 1
+        return [db.FakeRedis.get(self, k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        """Batch commands into one round trip."""
+        self.trips += 1
+        return db.FakeRedis.pipeline(self)
+
+
+class FlakyRedis(db.FakeRedis):
+    """A fake redis client that cannot be reached a number of times."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def ping(self):
+        """Fail to check the connection, until out of failures."""
+        if self.failures:
+            self.failures -= 1
+            raise redis.exceptions.ConnectionError()
+        return True
+
+
+def make_eliciter(random, n=300):
+    """Make an active max eliciter over random candidates."""
+    X = random.rand(n, 3)
+    candidates = elicit.CandidateSet([f"c{i}" for i in range(n)], X,
+                                     ["a", "b", "c"])
+    return elicit.ActiveMaxEliciter(candidates, {})
+
+
+def test_codec(random):
+    """Test session state round trips with scenario data stored apart."""
+    blobs = {}
+    db._written.clear()  # blobs already put by other tests
+    eliciter = make_eliciter(random)
+    eliciter.put(eliciter.query()[0].name)
+
+    raw = db.encode(eliciter, blobs.__setitem__)
+    assert raw.startswith(db.FORMAT)
+    assert len(raw) < len(pickle.dumps(eliciter)) // 2
+    assert blobs  # the scores and names are stored once
+
+    db._blobs.clear()
+    restored = db.decode(raw, blobs.get)
+    assert restored.candidates.names == eliciter.candidates.names
+    assert np.all(restored.candidates.scores == eliciter.candidates.scores)
+    assert restored.query()[1].name == eliciter.query()[1].name
+    assert not restored.candidates.scores.flags.writeable
+
+
+def test_legacy(random):
+    """Test sessions pickled by earlier versions can still be read."""
+    eliciter = make_eliciter(random, n=20)
+    restored = db.decode(pickle.dumps(eliciter), {}.get)
+    assert restored.candidates.names == eliciter.candidates.names
+
+
+def test_request_scope(random):
+    """Test a request reads each key once and writes changes together."""
+    r = CountingRedis()
+    scope = types.SimpleNamespace()
+    store = db.RedisDB(r, {"id": "s"}, scope)
+
+    store.eliciter = make_eliciter(random, n=20)
+    store.logger = ["log"]
+    assert r.trips == 0
+    store.flush()
+    assert r.get("s/eliciter") and r.get("s/logger")
+
+    r.trips = 0
+    store.prefetch("eliciter", "logger")
+    eliciter = store.eliciter
+    assert store.logger == ["log"]
+    assert store.eliciter is eliciter
+    assert r.trips == 1
+
+    del store.logger
+    store.flush()
+    assert r.get("s/logger") is None
+    assert store.eliciter is not eliciter  # a new request reads again
+
+
+def test_expiry():
+    """Test sessions expire unless they are used."""
+    r = db.FakeRedis()
+    store = db.RedisDB(r, {"id": "s"}, types.SimpleNamespace(), ttl=100)
+
+    store.logger = ["log"]
+    store.flush()
+    assert 99 <= r.ttl("s/logger") <= 100
+
+    r.expire("s/logger", 10)
+    assert store.logger == ["log"]
+    store.flush()  # reading refreshes the expiry
+    assert r.ttl("s/logger") > 10
+
+    r.expire("s/logger", 0)
+    assert store.logger is None
+
+
+def test_purge():
+    """Test abandoned sessions are deleted in bulk."""
+    r = db.FakeRedis()
+    for ident in ("old", "new"):
+        store = db.RedisDB(r, {"id": ident}, types.SimpleNamespace())
+        store.logger = [ident]
+        store.flush()
+    r.zadd(db.SESSIONS, {"old": 0.})
+    r.set("legacy/logger", b"")  # from before sessions expired
+
+    assert db.purge(r, max_age=60) == 1
+    assert r.get("old/logger") is None
+    assert r.get("new/logger") is not None
+    assert r.ttl("legacy/logger") == 60
+
+
+def test_sessions_trimmed():
+    """Test the record of sessions forgets those that have expired."""
+    r = db.FakeRedis()
+    r.zadd(db.SESSIONS, {"expired": 0., "recent": time.time() - 30})
+    store = db.RedisDB(r, {"id": "s"}, types.SimpleNamespace(), ttl=60)
+    store.logger = ["log"]
+    store.flush()
+
+    idents = r.zrangebyscore(db.SESSIONS, "-inf", "inf")
+    assert sorted(idents) == [b"recent", b"s"]
+
+
+def test_retry():
+    """Test commands are retried, and fail once out of retries."""
+    scope = types.SimpleNamespace()
+    db.RedisDB(FlakyRedis(2), {}, scope, retries=2, backoff=0.)
+    with pytest.raises(db.StorageError):
+        db.RedisDB(FlakyRedis(3), {}, scope, retries=2, backoff=0.)
+
+
+def test_bind():
+    """Test storage can be bound to a session outside of its requests."""
+    r = db.FakeRedis()
+    store = db.RedisDB(r, {"id": "s"}, types.SimpleNamespace())
+
+    bound = store.bind("s")
+    bound.branches = ("tag", {})
+    bound.flush()
+    assert store.branches == ("tag", {})
+    assert bound.scope is not store.scope
+
+
+def test_blob_expiry(random, monkeypatch):
+    """Test using a session keeps the scenario data it refers to."""
+    now = [1000.]
+    monkeypatch.setattr(db.time, "time", lambda: now[0])
+    db._written.clear()
+    hour = 60 * 60
+    r = db.FakeRedis()
+    store = db.RedisDB(r, {"id": "s"}, types.SimpleNamespace())
+
+    store.eliciter = make_eliciter(random)
+    store.flush()
+
+    # a click that re-encodes the state without putting the blobs again
+    now[0] += 11 * hour
+    store.eliciter = store.eliciter
+    store.flush()
+
+    # read by a process that has not seen the blobs
+    now[0] += 14 * hour
+    db._blobs.clear()
+    assert store.eliciter is not None
+    store.discard()
+
+    for key in r.scan_iter("blob/*"):
+        r.delete(key)
+    db._blobs.clear()
+    with pytest.raises(db.SessionExpired):
+        store.prefetch("eliciter")
+
+
+def test_blob_lost(random):
+    """Test blobs that redis lost are put back, however recently written."""
+    r = db.FakeRedis()
+    store = db.RedisDB(r, {"id": "s"}, types.SimpleNamespace())
+    eliciter = make_eliciter(random)
+    store.eliciter = eliciter
+    store.flush()
+
+    # redis restarts without its data, and the session starts again
+    for key in list(r.scan_iter("*")):
+        r.delete(key)
+    store.eliciter = eliciter
+    store.flush()
+
+    # read by a process that has not seen the blobs
+    db._blobs.clear()
+    assert store.eliciter.candidates.names == eliciter.candidates.names
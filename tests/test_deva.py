@@ -5,6 +5,7 @@ Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
 from deva import elicit
 from itertools import permutations
+import copy
 import pickle
 import numpy as np
 import pytest
@@ -63,3 +64,53 @@ def test_pickleable(algorithm):
     eliciter.put(eliciter.query()[0].name)
 
     pickle.dumps(eliciter)  # will error if not pickleable
+
+
+def test_candidate_set():
+    """Test the columnar candidate set and its candidate views."""
+    candidates, _, attribs = make_data()
+    cset = elicit.CandidateSet.from_candidates(candidates)
+
+    assert len(cset) == len(candidates)
+    assert cset.attribs == attribs
+    assert cset[3].name == candidates[3].name
+    assert cset[3].attributes == candidates[3].attributes
+    assert cset[3]["X2"] == candidates[3]["X2"]
+    assert not cset.scores.flags.writeable
+
+    subset = cset[cset.column("X1") == 0]
+    assert len(subset) == 6
+    assert np.all(subset.table(["X1"]) == 0)
+
+    restored = pickle.loads(pickle.dumps(subset))
+    assert restored.names == subset.names
+    assert not restored.scores.flags.writeable
+
+
+def test_candidate_set_copy():
+    """Test copies of a candidate set share its scores, but not names."""
+    candidates, _, _ = make_data()
+    cset = elicit.CandidateSet.from_candidates(candidates)
+    pair = copy.deepcopy([cset, cset])
+
+    assert pair[0] is pair[1]
+    assert pair[0].scores is cset.scores
+    assert pair[0].names == cset.names
+    pair[0].names[0] = "changed"
+    assert cset.names[0] == candidates[0].name
+
+
+def test_enautilus_prune():
+    """Test E-NAUTILUS prunes candidates worse than the chosen point."""
+    candidates, scenario, attribs = make_data()
+    eliciter = elicit.EnautilusEliciter(candidates, scenario)
+    scores = eliciter.candidates.scores
+
+    choice = eliciter.query()[0]
+    eliciter.put(choice.name)
+
+    nadir = choice.get_attr_values()
+    kept = np.zeros(len(scores), dtype=bool)
+    kept[eliciter.remaining] = True
+    assert np.all(kept == (scores <= nadir).all(axis=1))
+    assert eliciter.candidates.scores is scores  # not copied
@@ -0,0 +1,107 @@
+"""
+Test the elicitation steps shared by the servers.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import json
+import pytest
+from deva.elicit import CandidateSet
+from deva.index import BoxIndex
+
+import elicitation
+
+
+@pytest.fixture
+def candidates(random):
+    """Make candidates with repeated scores."""
+    scores = random.randint(0, 20, size=(200, 3)).astype(float)
+    return CandidateSet([str(i) for i in range(200)], scores, ["a", "b", "c"])
+
+
+def _select(candidates, **query):
+    """Select candidates for query parameters given as strings."""
+    query = {k: v if isinstance(v, str) else json.dumps(v)
+             for k, v in query.items()}
+    return elicitation.select_candidates(candidates, BoxIndex(candidates),
+                                         query)
+
+
+def test_select_all(candidates):
+    """Test every candidate is selected without query parameters."""
+    selected, count = _select(candidates)
+    assert selected.names == candidates.names
+    assert count == len(candidates)
+
+
+@pytest.mark.parametrize("offset, limit", [
+    (0, 10), (50, 25), (190, 50), (200, 10), (300, 5), (20, 0),
+])
+def test_select_page(candidates, offset, limit):
+    """Test pagination gives the page, and counts the candidates before it."""
+    selected, count = _select(candidates, offset=offset, limit=limit)
+    assert selected.names == candidates.names[offset:offset + limit]
+    assert count == len(candidates)
+
+    selected, count = _select(candidates, offset=offset)
+    assert selected.names == candidates.names[offset:]
+    assert count == len(candidates)
+
+
+def test_select_constraints(candidates):
+    """Test the constraints are applied before the page is taken."""
+    constraints = {"a": [5, 12], "c": [0, 9]}
+    expected = [c.name for c in candidates
+                if 5 <= c["a"] <= 12 and c["c"] <= 9]
+
+    selected, count = _select(candidates, constraints=constraints,
+                              offset=3, limit=10)
+    assert selected.names == expected[3:13]
+    assert count == len(expected)
+
+
+@pytest.mark.parametrize("sample", [None, "grid", "representative"])
+def test_select_empty(candidates, sample):
+    """Test constraints that no candidate meets select none."""
+    query = {"constraints": {"a": [30, 40]}, "limit": 5}
+    if sample is not None:
+        query["sample"] = sample
+    selected, count = _select(candidates, **query)
+    assert len(selected) == 0
+    assert count == 0
+
+
+@pytest.mark.parametrize("sample, size", [
+    ("grid", {"bins": 3}), ("representative", {"size": 20}),
+])
+def test_select_sample(candidates, sample, size):
+    """Test samples are counted before pagination, in scenario order."""
+    sampled, count = _select(candidates, sample=sample, **size)
+    assert 0 < count == len(sampled) < len(candidates)
+    rows = [candidates.names.index(n) for n in sampled.names]
+    assert rows == sorted(rows)
+    if sample == "representative":
+        assert count == size["size"]
+
+    selected, count_page = _select(candidates, sample=sample, offset=2,
+                                   limit=5, **size)
+    assert selected.names == sampled.names[2:7]
+    assert count_page == count
+
+
+@pytest.mark.parametrize("query", [
+    {"offset": -1},
+    {"limit": -5},
+    {"offset": "first"},
+    {"limit": 2.5},
+    {"sample": "everything"},
+    {"sample": "grid", "bins": 0},
+    {"sample": "representative", "size": "many"},
+    {"constraints": "{"},
+    {"constraints": {"z": [0, 1]}},
+    {"constraints": {"a": 5}},
+    {"constraints": {"a": ["low", "high"]}},
+])
+def test_select_invalid(candidates, query):
+    """Test invalid query parameters raise ValueError."""
+    with pytest.raises(ValueError):
+        _select(candidates, **query)
@@ -0,0 +1,121 @@
+"""
+Test loading scenarios from disk.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import os
+import numpy as np
+import toml
+from deva import fileio
+
+
+def write_model(path, name, metrics):
+    """Write the metrics and params files of a model."""
+    models = os.path.join(path, "models")
+    os.makedirs(models, exist_ok=True)
+    with open(os.path.join(models, f"metrics_{name}.toml"), "w") as f:
+        toml.dump(metrics, f)
+    with open(os.path.join(models, f"params_{name}.toml"), "w") as f:
+        toml.dump({}, f)
+
+
+def test_model_cache(tmp_path):
+    """Test the compiled model cache is reused until the models change."""
+    path = str(tmp_path)
+    write_model(path, "b", {"x": 2, "y": 1})
+    write_model(path, "a", {"x": 1, "y": 2})
+
+    names, attribs, scores = fileio.load_models(path)
+    assert names == ["a", "b"]
+    assert attribs == ["x", "y"]
+    assert np.all(scores == [[1, 2], [2, 1]])
+    assert os.path.exists(os.path.join(path, fileio.CACHE_DIR, "index.json"))
+
+    key = fileio.cache_key(fileio.get_all_files(path))
+    assert fileio._read_cache(path, key) is not None
+
+    write_model(path, "c", {"x": 3, "y": 3})
+    names, _, scores = fileio.load_models(path)
+    assert names == ["a", "b", "c"]
+    assert scores.shape == (3, 2)
+
+
+def test_scenario_cache(repo):
+    """Test cached scenarios are shared but callers get their own copy."""
+    cache = fileio.ScenarioCache(maxsize=1)
+    candidates, spec = cache.load("jobs")
+    candidates.names[0] = "changed"
+    spec["metrics"].clear()
+
+    candidates, spec = cache.load("jobs")
+    assert candidates.names[0] != "changed"
+    assert spec["metrics"]
+    assert len(cache._entries) == 1
+
+
+def test_front_cache(repo):
+    """Test the compiled front is memory mapped and matches a fresh load."""
+    assert not (repo / "scenarios" / "jobs" / fileio.CACHE_DIR).exists()
+    fresh, _ = fileio.load_scenario("jobs", use_cache=False)
+    fileio.load_scenario("jobs")  # compiles the front
+    cached, _ = fileio.load_scenario("jobs")
+
+    assert cached.names == fresh.names
+    assert cached.spec_names == fresh.spec_names
+    assert np.all(cached.scores == fresh.scores)
+
+    base = cached.scores
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert base is not None  # a view of the mapped file
+
+
+def test_scenario_index(repo, monkeypatch):
+    """Test the cached index refers to the rows of the loaded candidates."""
+    cache = fileio.ScenarioCache(maxsize=1)
+    candidates, _ = cache.load("jobs")
+    index = cache.index("jobs")
+    assert cache.index("jobs") is index
+    assert len(index) == len(candidates)
+
+    attr = candidates.attribs[0]
+    values = candidates.column(attr)
+    lo, hi = np.percentile(values, [25, 75])
+    rows = index.query({attr: (lo, hi)})
+    assert np.all(rows == np.flatnonzero((values >= lo) & (values <= hi)))
+
+    def unchecked(name):
+        raise AssertionError("the files were checked")
+
+    with monkeypatch.context() as m:
+        m.setattr(fileio, "scenario_stamp", unchecked)
+        assert cache.index("jobs", validate=False) is index
+
+    cache.clear()
+    assert cache.index("jobs") is not index
+
+
+def test_scenario_revalidation(repo, monkeypatch):
+    """Test cache hits only stat every model file now and then."""
+    cache = fileio.ScenarioCache(revalidate=None)
+    cache.load("jobs")
+
+    calls = []
+    full_key = fileio.scenario_key
+    monkeypatch.setattr(fileio, "scenario_key",
+                        lambda name: calls.append(name) or full_key(name))
+    cache.load("jobs")
+    cache.index("jobs")
+    assert not calls
+
+    # a changed toml file changes the stamp
+    metadata = repo / "scenarios" / "jobs" / "metadata.toml"
+    stat = metadata.stat()
+    os.utime(metadata, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache.load("jobs")
+    assert calls == ["jobs"]
+
+    # models edited in place are found by the periodic full check
+    cache.revalidate = 0.
+    cache.load("jobs")
+    assert len(calls) == 2
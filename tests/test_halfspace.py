@@ -74,7 +74,42 @@ def test_impute_label_random_order(random, shatterable_data):
     assert np.all(Y == Y_hat)
 
 
-def test_arank(random):
+def test_engine_matches_impute_label(random, shatterable_data):
+    """Test the incremental engine agrees with fresh label imputation."""
+    X, Y = shatterable_data
+    perm = random.permutation(len(Y))
+    X = X[perm, :]
+    Y = Y[perm]
+
+    engine = halfspace.ShatterEngine(X.shape[1] - 1, capacity=2)
+    Y_hat = np.zeros_like(Y)
+    for i in range(len(Y)):
+        halfspace.impute_label(X[:i + 1], Y_hat[:i + 1])
+        assert engine.impute(X[i]) == Y_hat[i]
+        if Y_hat[i] == 0:
+            engine.add(X[i], Y[i])
+        Y_hat[i] = Y[i]
+
+
+def test_engine_classify(random):
+    """Test batch classification agrees with imputing labels one by one."""
+    r = np.array([0.5, -1., 2.])
+    X = random.randn(40, 3)
+    H = np.array([halfspace.hyperplane(X[i], X[i + 1]) for i in range(39)])
+    Y = np.sign(H @ np.append(r, -1.))
+
+    engine = halfspace.ShatterEngine(3)
+    for h, y in zip(H[:8], Y[:8]):
+        engine.add(h, y)
+
+    labels, decided = engine.classify(H[8:])
+    assert decided.any()
+    for h, label in zip(H[8:][decided], labels[decided]):
+        assert engine.impute(h) == label
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_arank(random, batch):
     """Test the ranking algorithm."""
     n = 30
     X = random.multivariate_normal(
@@ -94,7 +129,8 @@ def test_arank(random):
 
     ranker = halfspace.HalfspaceRanking(
         X,
-        query_order=halfspace.rank_compar_ord
+        query_order=halfspace.rank_compar_ord,
+        batch=batch
     )
     while ranker.next_round():
         a, b = ranker.get_query()
@@ -106,12 +142,44 @@ def test_arank(random):
     assert cnt < n * (n - 1) // 2
 
 
+@pytest.mark.parametrize("monotone", [False, True])
+def test_asort(random, monotone):
+    """Test the binary insertion ranking algorithm."""
+    n = 30
+    X = random.rand(n, 2)
+    r = X.max(axis=0) + 1.  # beyond the worst point, so lower is better
+    cnt = 0
+
+    def oracle_fn(a, b):
+        nonlocal cnt
+        cnt += 1
+        ar = ((a - r)**2).sum()
+        br = ((b - r)**2).sum()
+        return -1 if ar < br else 1
+
+    sorter = halfspace.HalfspaceSort(
+        X,
+        query_order=halfspace.max_compar_rand,
+        monotone=monotone
+    )
+    while sorter.next_round():
+        a, b = sorter.get_query()
+        sorter.put_response(oracle_fn(a, b))
+
+    dist = ((X - r)**2).sum(axis=1)
+    true_ranks = np.argsort(dist)
+    assert np.all(true_ranks == sorter.get_result())
+    assert cnt < n * np.log2(n)
+    assert sorter.engine.n == cnt  # only the oracle labels are kept
+
+
 @pytest.mark.parametrize("query_order", [
     halfspace.max_compar_smooth,
     halfspace.max_compar_rand,
     partial(halfspace.max_compar_primary, primary_index=0)
 ])
-def test_amax(random, query_order):
+@pytest.mark.parametrize("batch", [False, True])
+def test_amax(random, query_order, batch):
     """Test the active max algorithm."""
     n = 30
     X = random.multivariate_normal(
@@ -129,7 +197,7 @@ def test_amax(random, query_order):
         br = ((b - r)**2).sum()
         return -1 if ar < br else 1
 
-    maxer = halfspace.HalfspaceMax(X, query_order=query_order)
+    maxer = halfspace.HalfspaceMax(X, query_order=query_order, batch=batch)
     while maxer.next_round():
         a, b = maxer.get_query()
         maxer.put_response(oracle_fn(a, b))
@@ -138,3 +206,94 @@ def test_amax(random, query_order):
     true_max = np.argmax(dist)
     assert np.all(true_max == maxer.get_result())
     assert cnt < n
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_amax_monotone(random, batch):
+    """Test pareto dominance settles comparisons without linear programs."""
+    n = 30
+    X = random.rand(n, 3)
+    r = X.max(axis=0) + 2.  # beyond the worst point, so lower is better
+
+    def oracle_fn(a, b):
+        ar = ((a - r)**2).sum()
+        br = ((b - r)**2).sum()
+        return -1 if ar < br else 1
+
+    maxer = halfspace.HalfspaceMax(X, query_order=halfspace.max_compar_rand,
+                                   monotone=True, batch=batch)
+    while maxer.next_round():
+        a, b = maxer.get_query()
+        maxer.put_response(oracle_fn(a, b))
+
+    dist = ((X - r)**2).sum(axis=1)
+    assert np.argmax(dist) == maxer.get_result()
+    assert maxer.engine.counts["prior"] > 0
+
+
+def test_amax_batch_questions():
+    """Test batch mode asks no more questions than the sequential mode."""
+    random = np.random.RandomState(42)  # includes cases it used to ask more
+    for _ in range(8):
+        X = random.rand(120, 4)
+        r = X.max(axis=0) + random.rand(4) + .5  # lower is better
+        order = halfspace.max_compar_rand(X, random_state=random)
+
+        def ask(batch):
+            maxer = halfspace.HalfspaceMax(
+                X, query_order=lambda X: order, yield_indices=True,
+                monotone=True, batch=batch)
+            queries = []
+            while maxer.next_round():
+                a, b = maxer.get_query()
+                queries.append((a, b))
+                ar = ((X[a] - r)**2).sum()
+                br = ((X[b] - r)**2).sum()
+                maxer.put_response(-1 if ar < br else 1)
+            return queries, maxer.get_result()
+
+        queries, result = ask(False)
+        queries_b, result_b = ask(True)
+        assert len(queries_b) <= len(queries)
+        assert result_b == result
+
+
+@pytest.mark.parametrize("alg", ["max", "rank"])
+def test_parallel(random, alg):
+    """Test solving linear programs in processes asks the same questions."""
+    X = random.rand(20, 3)
+    r = X.max(axis=0) + 2.
+
+    def run(n_jobs):
+        if alg == "max":
+            active = halfspace.HalfspaceMax(
+                X, query_order=halfspace.max_compar_smooth, n_jobs=n_jobs)
+        else:
+            active = halfspace.HalfspaceRanking(
+                X, query_order=halfspace.rank_compar_ord, n_jobs=n_jobs)
+        queries = []
+        while active.next_round():
+            a, b = active.get_query()
+            queries.append((a, b))
+            ar = ((a - r)**2).sum()
+            br = ((b - r)**2).sum()
+            active.put_response(-1 if ar < br else 1)
+        return queries, active.get_result()
+
+    queries, result = run(1)
+    queries_p, result_p = run(2)
+    assert np.array_equal(np.array(queries), np.array(queries_p))
+    assert np.array_equal(result, result_p)
+
+
+def test_shutdown():
+    """Test the shared process pools are stopped, and remade on demand."""
+    engine = halfspace.ShatterEngine(2, n_jobs=2)
+    h = np.array([1., -1., 0.])
+    assert engine.feasible(h, 1)
+    assert halfspace._executors
+    halfspace.shutdown()
+    assert not halfspace._executors and not halfspace._futures
+    engine = halfspace.ShatterEngine(2, n_jobs=2)
+    assert engine.feasible(h, -1)
+    halfspace.shutdown()
@@ -0,0 +1,45 @@
+"""
+Test the box query index.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import numpy as np
+import pytest
+from deva.elicit import CandidateSet
+from deva.index import BoxIndex
+
+
+@pytest.fixture
+def candidates(random):
+    """Make candidates with repeated scores."""
+    scores = random.randint(0, 20, size=(500, 3)).astype(float)
+    return CandidateSet([str(i) for i in range(500)], scores, ["a", "b", "c"])
+
+
+@pytest.mark.parametrize("constraints", [
+    {},
+    {"a": (5, 12)},
+    {"b": (3, 3)},
+    {"a": (0, 10), "c": (4.5, 30)},
+    {"a": (2, 18), "b": (5, 9), "c": (0, 6)},
+    {"c": (10, 5)},
+])
+def test_query(candidates, constraints):
+    """Test box queries match a direct check of every candidate."""
+    index = BoxIndex(candidates)
+    expected = [i for i, c in enumerate(candidates)
+                if all(lo <= c[a] <= hi for a, (lo, hi)
+                       in constraints.items())]
+
+    rows = index.query(constraints)
+    assert np.all(rows == expected)
+    assert index.count(constraints) == len(expected)
+
+
+def test_invalid(candidates):
+    """Test unknown attributes and malformed ranges are rejected."""
+    index = BoxIndex(candidates)
+    with pytest.raises(KeyError):
+        index.query({"d": (0, 1)})
+    with pytest.raises(ValueError):
+        index.count({"a": (0, "x")})
@@ -3,7 +3,9 @@ Unit tests for estimating a bounds range from data.
 
 Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
-from deva.fileio import nice_range
+import math
+import numpy as np
+from deva.fileio import nice_range, nice_ranges
 
 
 def test_rounded():
@@ -40,3 +42,41 @@ def test_true_range():
     """Test on true ranges."""
     assert(nice_range(0, 3872) == (-1000, 4000))
     assert(nice_range(0, 3910) == (-1000, 4000))
+
+
+def test_vectorised():
+    """Test the vectorised ranges, elementwise."""
+    a = [1, -4, 0, -100, 13.9, 122, 0, 0.25]
+    b = [14, 90, 0, -10, 52.7, 69, 3872, 0.5]
+    expected = [(0, 20), (-10, 100), (-1, 1), (-110, 0), (10, 60),
+                (60, 130), (-1000, 4000), (0, 1)]
+    assert list(zip(*nice_ranges(a, b))) == expected
+
+
+def _scalar_nice_range(a, b):
+    """Compute a nice range one at a time, as it was before vectorising."""
+    min_num = min(a, b)
+    max_num = max(a, b)
+    diff = math.ceil(max_num - min_num)
+    div = 10**(len(str(diff)) - 1)
+
+    if min_num % div == 0:
+        min_num -= div
+    if max_num % div == 0:
+        max_num += div
+    min_num = math.floor(min_num / div) * div
+    max_num = math.ceil(max_num / div) * div
+    return (min_num, max_num)
+
+
+def test_vectorised_scalar():
+    """Test the vectorised ranges match the scalar computation."""
+    random = np.random.RandomState(42)
+    a = np.round(random.uniform(-5000, 5000, 200), 1)
+    b = a + np.round(random.exponential(10, 200) ** 2, 2)
+    # and integer spans, with limits that are multiples of the rounding
+    a[:8] = [0, -10, 100, 0, -4, 30, -1000, 5]
+    b[:8] = [0, 10, 200, 1000, 96, 30, 2000, 7]
+    expected = [_scalar_nice_range(x, y) for x, y in zip(a.tolist(),
+                                                         b.tolist())]
+    assert list(zip(*nice_ranges(a, b))) == expected
@@ -3,7 +3,10 @@ Test the code to remove non-pareto-efficient candidates.
 
 Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
 """
-from deva.pareto import remove_non_pareto
+import numpy as np
+import pytest
+from deva.pareto import (remove_non_pareto, efficient_set, efficient_mask,
+                         dominates)
 from itertools import product
 
 
@@ -22,5 +25,26 @@ def test_pareto():
     assert ans == eff
 
 
+def test_efficient_set(random):
+    """Test the blocked filter against a brute force comparison."""
+    scores = random.randint(0, 6, size=(300, 3)).astype(float)
+    scores[-10:] = scores[:10]  # repeated candidates are not dominated
+
+    dom = dominates(scores, scores)
+    efficient, counts = efficient_set(scores, block_size=16)
+
+    assert np.all(efficient == ~dom.any(axis=1))
+    assert np.all(counts == dom[:, efficient].sum(axis=1))
+
+
+@pytest.mark.parametrize("dims", [2, 3, 4])
+def test_efficient_mask(random, dims):
+    """Test the low dimensional sweeps agree with the pairwise filter."""
+    scores = random.randint(0, 20, size=(500, dims)).astype(float)
+    scores[-10:] = scores[:10]
+
+    assert np.all(efficient_mask(scores) == efficient_set(scores)[0])
+
+
 if __name__ == "__main__":
     test_pareto()
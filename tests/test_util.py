@@ -0,0 +1,103 @@
+"""
+Test the JSON helpers of the servers.
+
+Copyright 2021-2022 Gradient Institute Ltd. <info@gradientinstitute.org>
+"""
+import json
+import numpy as np
+import pytest
+from deva.elicit import CandidateSet
+
+import elicitation
+import util
+
+
+@pytest.fixture
+def candidates():
+    """Make candidates with unrounded scores."""
+    scores = [[0.12345, 10., -3.33333], [2.71828, 0.5, 1e-5]]
+    return CandidateSet(["x", "y"], scores, ["b", "c", "a"])
+
+
+def _payload():
+    """Make a payload of the types that responses hold."""
+    return {
+        "values": [1.23456, np.float64(2.5), np.float32(0.1), np.int64(3),
+                   np.bool_(True), -0.0004],
+        "arrays": {"z": np.arange(3), "y": np.array([0.1234, 1e-4, 2.]),
+                   "x": np.array([0.1234], dtype=np.float32)},
+        "nested": ({"b": None, "a": "text"}, [1, 2.]),
+    }
+
+
+def test_round_floats():
+    """Test floats are rounded however they are nested."""
+    rounded = util.round_floats(_payload())
+    assert rounded["values"] == [1.235, 2.5, 0.1, 3, True, -0.0]
+    assert all(isinstance(v, (float, int, bool)) for v in rounded["values"])
+    assert rounded["nested"] == [{"b": None, "a": "text"}, [1, 2.]]
+    arrays = rounded["arrays"]
+    assert np.array_equal(arrays["y"], [0.123, 0., 2.])
+    assert np.array_equal(arrays["x"], [0.123])
+    assert arrays["z"].dtype.kind == "i"
+    assert util.round_floats(2.71828, 1) == 2.7
+
+
+def test_round_array():
+    """Test float arrays are rounded to doubles, and others are unchanged."""
+    a = np.array([[0.12345, 1.5], [-2.0004, 3.]])
+    assert np.array_equal(util.round_array(a), [[0.123, 1.5], [-2., 3.]])
+    assert np.array_equal(util.round_array(a, 1), [[0.1, 1.5], [-2., 3.]])
+    a32 = util.round_array(np.array([0.1234], dtype=np.float32))
+    assert a32.dtype == float and a32.tolist() == [0.123]
+    ints = np.arange(4)
+    assert util.round_array(ints) is ints
+
+
+@pytest.mark.skipif(util.orjson is None, reason="orjson is not installed")
+@pytest.mark.parametrize("o", [
+    util.round_floats(_payload()),
+    {"nan": float("nan"), "inf": [np.inf, -np.inf],
+     "scalar": np.float64(np.nan),
+     "arrays": [np.array([1.5, np.nan]), np.array([np.inf], np.float32)]},
+])
+def test_dumps_backends(monkeypatch, o):
+    """Test orjson and the json module give the same (valid) JSON."""
+    fast = util.dumps(o)
+    monkeypatch.setattr(util, "orjson", None)
+    assert util.dumps(o) == fast
+    assert b"NaN" not in fast and b"Infinity" not in fast
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_dumps(monkeypatch, backend):
+    """Test the JSON is compact, with sorted keys, and numpy values."""
+    if backend == "json":
+        monkeypatch.setattr(util, "orjson", None)
+    elif util.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    o = {"b": {"d": 1, "c": [np.int64(2), np.float64(0.5)]},
+         "a": np.array([[1, 2], [3, 4]]), "e": np.bool_(False)}
+    expected = b'{"a":[[1,2],[3,4]],"b":{"c":[2,0.5],"d":1},"e":false}'
+    assert util.dumps(o) == expected
+    assert util.dumps({"a": [0.12345, np.float64(2.71828)]}, 2) == (
+        b'{"a":[0.12,2.72]}')
+
+    with pytest.raises(TypeError):
+        util.dumps({"a": object()})
+
+
+def test_candidate_payload(candidates):
+    """Test the rows and columns shapes hold the same rounded scores."""
+    rows = elicitation.candidate_payload(candidates)
+    assert rows == [{"a": -3.333, "b": 0.123, "c": 10.},
+                    {"a": 0., "b": 2.718, "c": 0.5}]
+
+    columns = elicitation.candidate_payload(candidates, "columns")
+    assert list(columns) == ["a", "b", "c"]
+    assert all(isinstance(v, np.ndarray) for v in columns.values())
+    assert json.loads(util.dumps(columns)) == {
+        a: [row[a] for row in rows] for a in rows[0]}
+    assert util.dumps(columns) == (
+        b'{"a":[-3.333,0.0],"b":[0.123,2.718],"c":[10.0,0.5]}')